@@ -1,7 +1,8 @@
 import streamlit as st
 import pandas as pd
 import os
-import google.generativeai as genai
+import threading
+import time
 
 
 
@@ -14,8 +15,13 @@ from services.database_service import DatabaseService
 from services.ai_service import AIService
 from services.visualization_service import VisualizationService
 from services.data_loader import DataLoader
+from services.query_pipeline import QueryPipeline
+from services.query_guard import QueryCancelled, QueryTooExpensive, QueryNotAllowed
 from utils.sample_data_generator import SampleDataGenerator
 
+# Rows shown per result page; the full result is capped by DatabaseService.max_result_rows
+RESULT_PAGE_ROWS = 1000
+
 # Page configuration
 st.set_page_config(
     page_title="E-Commerce Data Analysis AI Agent",
@@ -30,10 +36,17 @@ def initialize_services():
         st.session_state.db_service = DatabaseService()
     if 'ai_service' not in st.session_state:
         st.session_state.ai_service = AIService()
+        st.session_state.db_service.add_table_listener(st.session_state.ai_service.sql_cache.invalidate_table)
     if 'viz_service' not in st.session_state:
         st.session_state.viz_service = VisualizationService()
     if 'data_loader' not in st.session_state:
         st.session_state.data_loader = DataLoader()
+    if 'query_pipeline' not in st.session_state:
+        st.session_state.query_pipeline = QueryPipeline(
+            st.session_state.ai_service,
+            st.session_state.db_service,
+            st.session_state.viz_service
+        )
 
 def login_page():
     """Simple login interface"""
@@ -76,15 +89,20 @@ def data_upload_section():
     
     with col1:
         st.write("**Product-Level Ad Sales and Metrics**")
-        ad_sales_file = st.file_uploader("Upload Ad Sales Data", type=['xlsx'], key="ad_sales")
+        ad_sales_file = st.file_uploader("Upload Ad Sales Data", type=['xlsx', 'csv', 'parquet'], key="ad_sales")
     
     with col2:
         st.write("**Product-Level Total Sales and Metrics**")
-        total_sales_file = st.file_uploader("Upload Total Sales Data", type=['xlsx'], key="total_sales")
+        total_sales_file = st.file_uploader("Upload Total Sales Data", type=['xlsx', 'csv', 'parquet'], key="total_sales")
     
     with col3:
         st.write("**Product-Level Eligibility Table**")
-        eligibility_file = st.file_uploader("Upload Eligibility Data", type=['xlsx'], key="eligibility")
+        eligibility_file = st.file_uploader("Upload Eligibility Data", type=['xlsx', 'csv', 'parquet'], key="eligibility")
+    
+    incremental = st.checkbox(
+        "Incremental load (upsert new and changed rows instead of replacing tables)",
+        value=False
+    )
     
     # Process uploaded files
     if st.button("Process Uploaded Data", use_container_width=True):
@@ -99,14 +117,17 @@ def data_upload_section():
                     }
                     
                     # Load data into database
-                    st.session_state.data_loader.load_uploaded_data(files, st.session_state.db_service)
+                    timings = st.session_state.data_loader.load_uploaded_data(
+                        files, st.session_state.db_service, incremental=incremental
+                    )
                     st.session_state.data_loaded = True
                     st.success("Data processed and loaded into database successfully!")
+                    st.dataframe(pd.DataFrame(timings).T.round(2), use_container_width=True)
                     
                 except Exception as e:
                     st.error(f"Error processing data: {str(e)}")
         else:
-            st.warning("Please upload all three Excel files before processing.")
+            st.warning("Please upload all three data files before processing.")
     
     # Check for existing real data or sample data
     if not st.session_state.get('data_loaded', False):
@@ -162,6 +183,15 @@ def query_interface():
     col1, col2 = st.columns([1, 4])
     with col1:
         ask_button = st.button("🚀 Ask Question", use_container_width=True)
+        # Clicking Cancel interrupts the polling script run below and starts a new one; the query
+        # itself runs on a worker thread and stops when the event is set
+        if st.button("⏹️ Cancel Query", use_container_width=True):
+            pending = st.session_state.get('query_future')
+            if pending is not None and not pending.done():
+                st.session_state.query_cancel_event.set()
+                st.info("Query cancelled.")
+            else:
+                st.info("No query is running.")
     with col2:
         if st.session_state.get('last_sql'):
             st.code(st.session_state.last_sql, language='sql')
@@ -169,14 +199,23 @@ def query_interface():
     if ask_button and question:
         with st.spinner("Analyzing your question and generating response..."):
             try:
-                # Generate SQL query using AI
-                sql_query = st.session_state.ai_service.generate_sql_query(question)
+                # Generate SQL query using AI and execute it straight into a DataFrame
+                st.session_state.query_cancel_event = threading.Event()
+                future = st.session_state.query_pipeline.submit_query(
+                    question, cancel_event=st.session_state.query_cancel_event
+                )
+                st.session_state.query_future = future
+                # Updating the page while waiting lets Streamlit deliver a Cancel click to this run
+                progress = st.empty()
+                started = time.monotonic()
+                while not future.done():
+                    progress.caption(f"Running query... {time.monotonic() - started:.0f}s")
+                    time.sleep(0.2)
+                progress.empty()
+                sql_query, df = future.result()
                 st.session_state.last_sql = sql_query
                 
-                # Execute query
-                results = st.session_state.db_service.execute_query(sql_query)
-                
-                if results:
+                if df is not None:
                     # Display results
                     st.subheader("📋 Query Results")
                     
@@ -184,34 +223,46 @@ def query_interface():
                     with st.expander("🔍 Generated SQL Query"):
                         st.code(sql_query, language='sql')
                     
-                    # Display results as dataframe
-                    df = pd.DataFrame(results['data'], columns=results['columns'])
-                    st.dataframe(df, use_container_width=True)
-                    
-                    # Generate business insights
-                    insights = st.session_state.ai_service.generate_business_insights(question, df)
+                    # Show the first page now; further pages come from df, then from the database past the cap
+                    st.dataframe(df.head(RESULT_PAGE_ROWS), use_container_width=True)
+                    if df.attrs.get('truncated'):
+                        st.caption(f"Showing {min(len(df), RESULT_PAGE_ROWS):,} rows; analysis uses the first "
+                                   f"{len(df):,} rows (result cap reached).")
+                    elif len(df) > RESULT_PAGE_ROWS:
+                        st.caption(f"Showing {RESULT_PAGE_ROWS:,} of {len(df):,} rows.")
+                    st.session_state.result_browser = {
+                        'sql': sql_query,
+                        'frame': df,
+                        'truncated': bool(df.attrs.get('truncated')),
+                        'pages': [],
+                        'after': (min(len(df), RESULT_PAGE_ROWS)
+                                  if len(df) > RESULT_PAGE_ROWS or df.attrs.get('truncated') else None)
+                    }
                     
                     col1, col2 = st.columns([2, 1])
-                    
                     with col1:
                         st.subheader("💡 Business Insights")
-                        st.write(insights)
-                    
+                        insights_placeholder = st.empty()
                     with col2:
-                        # Generate and display visualization if applicable
-                        chart = st.session_state.viz_service.create_visualization(question, df)
-                        if chart:
-                            st.subheader("📊 Visualization")
-                            st.plotly_chart(chart, use_container_width=True)
-                            
-                            # Download button for chart
-                            chart_html = chart.to_html()
-                            st.download_button(
-                                label="💾 Download Chart",
-                                data=chart_html,
-                                file_name=f"chart_{question[:20].replace(' ', '_')}.html",
-                                mime="text/html"
-                            )
+                        chart_placeholder = st.container()
+                    
+                    # Insights and chart are built concurrently; render each as soon as it is ready
+                    streamed_insights = ""
+                    for stage, value in st.session_state.query_pipeline.analyze_iter(question, df, stream_insights=True):
+                        if stage == 'insights_chunk':
+                            streamed_insights += value
+                            insights_placeholder.markdown(streamed_insights + " ▌")
+                        elif stage == 'insights':
+                            if isinstance(value, Exception):
+                                insights_placeholder.warning(f"Insights unavailable: {str(value)}")
+                            else:
+                                insights_placeholder.markdown(value)
+                        elif stage == 'chart' and value is not None and not isinstance(value, Exception):
+                            with chart_placeholder:
+                                st.subheader("📊 Visualization")
+                                st.plotly_chart(value, use_container_width=True)
+                            # Export is prepared on request (see chart_export) rather than on every render
+                            st.session_state.last_chart = value
                     
                     # Store results for potential follow-up questions
                     st.session_state.last_results = df
@@ -220,9 +271,73 @@ def query_interface():
                 else:
                     st.warning("No results found for your query.")
                     
+            except (QueryTooExpensive, QueryNotAllowed) as e:
+                st.error(str(e))
+            except QueryCancelled as e:
+                st.warning(f"{str(e)}. Try narrowing the question (e.g. a date range or fewer products).")
             except Exception as e:
                 st.error(f"Error processing your question: {str(e)}")
                 st.write("Please try rephrasing your question or check if the data contains the information you're looking for.")
+    
+    result_browser()
+    chart_export()
+
+def chart_export():
+    """Download the last chart, serialized only when asked for"""
+    chart = st.session_state.get('last_chart')
+    if chart is None:
+        return
+    
+    with st.expander("💾 Download Chart"):
+        fmt = st.radio("Format", ["json", "html"], horizontal=True,
+                       help="json is the compact Plotly spec; html loads plotly.min.js from the same folder")
+        name = f"chart_{st.session_state.get('last_question', '')[:20].replace(' ', '_')}"
+        if st.button("Prepare download"):
+            st.download_button(
+                label=f"💾 Download {name}.{fmt}",
+                data=st.session_state.viz_service.export_figure(chart, fmt=fmt),
+                file_name=f"{name}.{fmt}",
+                mime="text/html" if fmt == "html" else "application/json"
+            )
+            if fmt == "html":
+                st.download_button(
+                    label="💾 Download plotly.min.js (once, save next to the chart)",
+                    data=st.session_state.viz_service.plotly_js(),
+                    file_name="plotly.min.js",
+                    mime="text/javascript"
+                )
+
+def result_browser():
+    """Page through the rest of the last query's result
+    
+    Pages are served from the rows already in memory; only a truncated result goes back
+    to the database, for the rows past the result cap.
+    """
+    browser = st.session_state.get('result_browser')
+    if not browser or (browser['after'] is None and not browser['pages']):
+        return
+    
+    with st.expander("📄 More rows", expanded=bool(browser['pages'])):
+        if browser['after'] is not None and st.button("⬇️ Load next page"):
+            frame, after = browser['frame'], browser['after']
+            try:
+                if after < len(frame):
+                    page = frame.iloc[after:after + RESULT_PAGE_ROWS].reset_index(drop=True)
+                    after += len(page)
+                    if after >= len(frame) and not browser['truncated']:
+                        after = None
+                else:
+                    page, after = st.session_state.db_service.fetch_page(
+                        browser['sql'], page_size=RESULT_PAGE_ROWS, after=after
+                    )
+                browser['pages'].append(page)
+                browser['after'] = after
+            except Exception as e:
+                st.error(f"Error fetching more rows: {str(e)}")
+        if browser['pages']:
+            st.dataframe(pd.concat(browser['pages'], ignore_index=True), use_container_width=True)
+        if browser['after'] is None:
+            st.caption("End of results.")
 
 def database_overview():
     """Show database schema and sample data"""
@@ -233,13 +348,16 @@ def database_overview():
         return
     
     try:
-        # Show table information
-        tables = st.session_state.db_service.get_table_info()
+        # Show table information (row counts are stored at load time; recount on request)
+        recount = st.button("🔄 Recount rows")
+        tables = st.session_state.db_service.get_table_info(refresh=recount)
         
         for table_name, info in tables.items():
             with st.expander(f"📋 Table: {table_name}"):
                 st.write(f"**Columns:** {len(info['columns'])}")
                 st.write(f"**Rows:** {info['row_count']}")
+                if info.get('loaded_at'):
+                    st.write(f"**Last loaded:** {info['loaded_at']} UTC")
                 
                 # Show column information
                 col_df = pd.DataFrame(info['columns'])
@@ -247,9 +365,8 @@ def database_overview():
                 
                 # Show sample data
                 if st.button(f"Show Sample Data for {table_name}", key=f"sample_{table_name}"):
-                    sample_data = st.session_state.db_service.execute_query(f"SELECT * FROM {table_name} LIMIT 5")
-                    if sample_data:
-                        sample_df = pd.DataFrame(sample_data['data'], columns=sample_data['columns'])
+                    sample_df = st.session_state.db_service.execute_query_df(f"SELECT * FROM {table_name} LIMIT 5")
+                    if sample_df is not None:
                         st.dataframe(sample_df, use_container_width=True)
                         
     except Exception as e:
@@ -285,8 +402,23 @@ def main():
             value=os.getenv("GEMINI_API_KEY", ""),
             help="Enter your Gemini API key for AI functionality"
         )
-        if api_key:
+        if api_key and api_key != os.getenv("GEMINI_API_KEY"):
             os.environ["GEMINI_API_KEY"] = api_key
+            # Switch a session that started offline over to Gemini (unless offline is forced)
+            if st.session_state.ai_service.is_offline and os.getenv("LLM_BACKEND", "gemini").lower() != "local":
+                st.session_state.query_pipeline.close()
+                del st.session_state['ai_service']
+                del st.session_state['query_pipeline']
+                st.rerun()
+        if st.session_state.ai_service.is_offline:
+            st.caption("Using the local offline model; answers are rule-based.")
+        else:
+            stats = st.session_state.ai_service.stats()
+            st.caption(f"Model: {st.session_state.ai_service.model_name}")
+            if stats.get('circuit') == 'open':
+                st.warning("Gemini is failing; answers are rule-based until it recovers.")
+            st.caption(f"Retries: {stats.get('retries', 0)} · circuit trips: {stats.get('trips', 0)} · "
+                       f"fallbacks: {stats['fallbacks']}")
     
     # Main content based on selected page
     if page == "📊 Data Management":
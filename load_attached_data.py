@@ -1,5 +1,5 @@
-import pandas as pd
 import os
+import time
 from services.database_service import DatabaseService
 from services.data_loader import DataLoader
 
@@ -16,37 +16,24 @@ def load_attached_excel_files():
             'eligibility': 'attached_assets/Product-Level Eligibility Table (mapped)_1753210886486.xlsx'
         }
         
-        # Check if files exist and load them
+        # Check which files exist, then parse them in parallel and load them
+        existing_files = {}
         for file_type, file_path in file_paths.items():
             if os.path.exists(file_path):
                 print(f"Loading {file_type} data from {file_path}")
-                try:
-                    df = pd.read_excel(file_path)
-                    print(f"Raw data shape: {df.shape}")
-                    print(f"Columns: {list(df.columns)}")
-                    
-                    # Clean the dataframe
-                    df_cleaned = data_loader.clean_dataframe(df)
-                    print(f"Cleaned data shape: {df_cleaned.shape}")
-                    print(f"Cleaned columns: {list(df_cleaned.columns)}")
-                    
-                    # Map file types to table names
-                    table_mapping = {
-                        'ad_sales': 'ad_sales_metrics',
-                        'total_sales': 'total_sales_metrics',
-                        'eligibility': 'eligibility_table'
-                    }
-                    
-                    table_name = table_mapping[file_type]
-                    db_service.create_table_from_dataframe(df_cleaned, table_name)
-                    print(f"Successfully loaded {file_type} data into {table_name} table")
-                    print("-" * 50)
-                    
-                except Exception as e:
-                    print(f"Error loading {file_type}: {str(e)}")
+                existing_files[file_type] = file_path
             else:
                 print(f"File not found: {file_path}")
         
+        start = time.perf_counter()
+        timings = data_loader.load_uploaded_data(existing_files, db_service)
+        for table_name, timing in timings.items():
+            print(f"Successfully loaded {table_name} table "
+                  f"(parse {timing['parse_seconds']:.2f}s, clean {timing['clean_seconds']:.2f}s, "
+                  f"store {timing['store_seconds']:.2f}s)")
+        print(f"Total load time: {time.perf_counter() - start:.2f}s")
+        print("-" * 50)
+        
         # Show database overview
         tables_info = db_service.get_table_info()
         print("\nDatabase Overview:")
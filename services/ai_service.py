@@ -1,52 +1,118 @@
 import os
+import time
 import pandas as pd
-from typing import Optional
-import google.generativeai as genai
+from typing import Optional, Iterator, Any, Dict, Tuple, Callable
 from dotenv import load_dotenv
+from services.sql_cache import SQLCache
+from services.result_sketch import ResultSketch
+from services.llm_backend import (
+    LLMBackend, LLMUnavailable, GeminiBackend, LocalBackend, BatchingBackend, ResilientBackend, call_with_timeout
+)
 
 # Load environment variables from .env file
 load_dotenv()
 
 class AIService:
-    def __init__(self):
-        """Initialize AI service with Gemini API"""
+    def __init__(self, model: Optional[Any] = None, backend: Optional[LLMBackend] = None):
+        """Initialize AI service with an LLM backend
+
+        By default Gemini is used when GEMINI_API_KEY is set (LLM_BACKEND=local forces
+        the offline stand-in), behind retry/circuit-breaker and batching layers shared
+        by all sessions. A backend, or a pre-built model exposing
+        generate_content(prompt, stream=...), can be passed instead, e.g. a local fake
+        for tests. When the provider is unavailable, answers come from the local
+        stand-in.
+        """
         self.api_key = os.getenv("GEMINI_API_KEY")
-        if not self.api_key:
-            raise ValueError("GEMINI_API_KEY environment variable is required")
-
-        # Configure the Gemini API
-        genai.configure(api_key=self.api_key)
-        
-        # Choose model: "gemini-1.5-pro" or "gemini-1.5-flash"
-        self.model_name = "gemini-1.5-flash"
-        self.model = genai.GenerativeModel(model_name=self.model_name)
-
-    def generate_sql_query(self, question: str, schema_context: str = "") -> str:
-        """Convert natural language question to SQL query"""
+        if backend is not None:
+            self.backend = backend
+        elif model is not None:
+            self.backend = GeminiBackend(model=model)
+        elif self.api_key and os.getenv("LLM_BACKEND", "gemini").lower() != "local":
+            # Choose model: "gemini-1.5-pro" or "gemini-1.5-flash"
+            model_name = os.getenv("GEMINI_MODEL", "gemini-1.5-flash")
+            key = f"gemini:{model_name}"
+            batching = BatchingBackend.shared(
+                key, lambda: GeminiBackend(self.api_key, model_name=model_name),
+                max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "8")),
+                requests_per_minute=int(os.getenv("LLM_REQUESTS_PER_MINUTE", "60"))
+            )
+            self.backend = ResilientBackend.shared(
+                key, lambda: batching,
+                max_retries=int(os.getenv("LLM_MAX_RETRIES", "3")),
+                deadline=float(os.getenv("LLM_DEADLINE_SECONDS", "45"))
+            )
+        else:
+            if not self.api_key:
+                print("GEMINI_API_KEY not set; using the local offline model")
+            self.backend = BatchingBackend.shared("local", LocalBackend, requests_per_minute=None)
+        self.model_name = self.backend.name
+        # Rule-based answers used when the provider is failing or the circuit is open
+        self.fallback = LocalBackend()
+        self.fallbacks = 0
+
+        # Persistent NL -> SQL cache shared across sessions
+        self.sql_cache = SQLCache()
+        # Token budget for the result summary in the insights prompt
+        self.insights_token_budget = 400
+        # Seconds for generating, validating and (once) repairing a query
+        self.sql_time_budget = 60.0
+        self.sql_counters = {'generated': 0, 'invalid': 0, 'repaired': 0, 'repair_failed': 0}
+
+    @property
+    def is_offline(self) -> bool:
+        """Whether answers come from the local stand-in rather than a real model"""
+        return self.backend.name == LocalBackend.name
+
+    def _generate(self, prompt: str, timeout: Optional[float] = None) -> Tuple[str, bool]:
+        """Generate with the backend, or the local stand-in if the provider is unavailable or too slow
+
+        Returns the text and whether it came from the fallback.
+        """
         try:
-            schema_info = """
-            Database Schema (Real E-commerce Data):
-
-            Table: ad_sales_metrics (3696 rows)
-            - Columns: date, item_id, ad_sales, impressions, ad_spend, clicks, units_sold
-
-            Table: total_sales_metrics (702 rows)
-            - Columns: date, item_id, total_sales, total_units_ordered
-
-            Table: eligibility_table (4381 rows)
-            - Columns: eligibility_datetime_utc, item_id, eligibility, message
-
+            if timeout is None:
+                return self.backend.generate(prompt), False
+            return call_with_timeout(self.backend.generate, timeout, prompt), False
+        except (LLMUnavailable, TimeoutError) as e:
+            print(f"LLM unavailable, using local fallback: {e}")
+            self.fallbacks += 1
+            return self.fallback.generate(prompt), True
+
+    @staticmethod
+    def _clean_sql(text: str) -> str:
+        """Strip markdown fences from a model answer"""
+        sql_query = text.strip()
+        if sql_query.startswith("```sql"):
+            sql_query = sql_query[6:]
+        elif sql_query.startswith("```"):
+            sql_query = sql_query[3:]
+        if sql_query.endswith("```"):
+            sql_query = sql_query[:-3]
+        return sql_query.strip()
+
+    def _build_sql_prompt(self, question: str, schema_context: str) -> str:
+        """Build the NL -> SQL prompt"""
+        # Fallback when no catalog is available; callers normally pass SchemaCatalog.prompt_context()
+        schema_info = schema_context or """
+            ad_sales_metrics: date, item_id, ad_sales, impressions, ad_spend, clicks, units_sold
+            total_sales_metrics: date, item_id, total_sales, total_units_ordered
+            eligibility_table: eligibility_datetime_utc, item_id, eligibility, message
             Notes:
             - item_id is the product identifier across all tables
-            - RoAS = ad_sales / ad_spend
-            - CPC = ad_spend / clicks
-            - CTR = clicks / impressions
-            - Use proper SQL for SQLite and JOINs where required
+            - RoAS = ad_sales / ad_spend, CPC = ad_spend / clicks, CTR = clicks / impressions
             """
 
-            prompt = f"""
+        rollup_rule = ""
+        if "rollup_" in schema_info:
+            rollup_rule = """
+            - rollup_* tables hold pre-aggregated sums (plus roas, cpc, ctr) per item, per day,
+              per item and week (week_start is the Monday) and overall; prefer them for totals
+              and KPIs, and query the raw tables only when a rollup cannot answer the question"""
+
+        return f"""
             You are an expert SQL query generator for e-commerce data analysis.
 
+            Database Schema (table (rows): column TYPE [date range] e.g. sample values):
             {schema_info}
 
             Question: {question}
@@ -55,37 +121,83 @@ class AIService:
             Follow these rules:
             - Use only the tables and columns above
             - SQLite syntax only
-            - Use correct JOINs, WHERE, GROUP BY, etc.
+            - Use correct JOINs, WHERE, GROUP BY, etc.{rollup_rule}
             - No explanation, return only SQL query
 
             SQL Query:
             """
 
-            response = self.model.generate_content(prompt)
-            sql_query = response.text.strip() if response.text else ""
+    @staticmethod
+    def _build_repair_prompt(prompt: str, sql_query: str, error: str) -> str:
+        """Ask the model to fix its own query, given the error from local validation"""
+        return f"""{prompt.rstrip()}
+            {sql_query}
 
-            # Remove markdown formatting if any
-            if sql_query.startswith("```sql"):
-                sql_query = sql_query[6:]
-            if sql_query.endswith("```"):
-                sql_query = sql_query[:-3]
+            The query above was rejected before execution:
+            {error}
 
-            return sql_query.strip()
+            Return a corrected single read-only SQLite SELECT query that answers the question.
+            No explanation, return only SQL query
 
-        except Exception as e:
-            raise Exception(f"Failed to generate SQL query: {str(e)}")
+            SQL Query:
+            """
 
-    def generate_business_insights(self, question: str, data: pd.DataFrame) -> str:
-        """Generate business insights from query results"""
+    def generate_sql_query(self, question: str, schema_context: str = "", schema_fingerprint: str = "",
+                           validate: Optional[Callable[[str], Optional[str]]] = None) -> str:
+        """Convert natural language question to SQL query
+
+        validate (e.g. DatabaseService.validate_sql) checks the query locally and returns
+        an error message for invalid SQL; one repair prompt carrying that error is sent
+        before giving up, all within sql_time_budget seconds. Only valid SQL is cached.
+        """
         try:
-            data_summary = f"Data shape: {data.shape}\n"
-            data_summary += f"Columns: {list(data.columns)}\n"
-            data_summary += f"Sample data:\n{data.head().to_string()}\n"
+            cached_sql = self.sql_cache.get(question, schema_fingerprint)
+            if cached_sql:
+                return cached_sql
+
+            deadline = time.monotonic() + self.sql_time_budget
+            prompt = self._build_sql_prompt(question, schema_context)
+            text, degraded = self._generate(prompt, timeout=self.sql_time_budget)
+            sql_query = self._clean_sql(text)
+            self.sql_counters['generated'] += 1
+
+            error = validate(sql_query) if validate is not None else None
+            if error:
+                self.sql_counters['invalid'] += 1
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.sql_counters['repair_failed'] += 1
+                    raise Exception(f"Generated SQL is invalid ({error}) and no time is left to repair it")
+                print(f"Repairing generated SQL: {error}")
+                text, repair_degraded = self._generate(
+                    self._build_repair_prompt(prompt, sql_query, error), timeout=remaining
+                )
+                degraded = degraded or repair_degraded
+                repaired = self._clean_sql(text)
+                error = validate(repaired)
+                if error:
+                    self.sql_counters['repair_failed'] += 1
+                    raise Exception(f"Generated SQL is invalid after one repair attempt: {error}")
+                self.sql_counters['repaired'] += 1
+                sql_query = repaired
+
+            # Stand-in answers (offline or fallback) are never cached: the cache is shared and
+            # persistent, so the real model must get the question once it is available
+            if sql_query and not degraded and not self.is_offline:
+                self.sql_cache.put(question, sql_query, schema_fingerprint)
+            return sql_query
 
-            if len(data) > 0:
-                data_summary += f"\nBasic statistics:\n{data.describe().to_string()}"
+        except Exception as e:
+            raise Exception(f"Failed to generate SQL query: {str(e)}")
 
-            prompt = f"""
+    def _build_insights_prompt(self, question: str, data: pd.DataFrame) -> str:
+        """Build the business insights prompt from query results"""
+        data_summary = ResultSketch.from_frame(data).render(self.insights_token_budget)
+        # Small results are cheaper to show verbatim than to describe
+        if 0 < len(data) <= 10:
+            data_summary += f"\nAll rows:\n{data.to_string(index=False, max_colwidth=40)}"
+
+        return f"""
             You are a business analyst expert specializing in e-commerce data.
 
             Question: {question}
@@ -100,12 +212,39 @@ class AIService:
             - Trends or concerns
             """
 
-            response = self.model.generate_content(prompt)
-            return response.text or "Unable to generate insights at this time."
+    def generate_business_insights(self, question: str, data: pd.DataFrame) -> str:
+        """Generate business insights from query results"""
+        try:
+            prompt = self._build_insights_prompt(question, data)
+            return self._generate(prompt)[0] or "Unable to generate insights at this time."
 
         except Exception as e:
             return f"Error generating business insights: {str(e)}"
 
+    def stream_business_insights(self, question: str, data: pd.DataFrame) -> Iterator[str]:
+        """Generate business insights, yielding text chunks as the model produces them"""
+        try:
+            prompt = self._build_insights_prompt(question, data)
+            produced = False
+            try:
+                for text in self.backend.stream(prompt):
+                    if text:
+                        produced = True
+                        yield text
+            except LLMUnavailable as e:
+                if produced:
+                    raise
+                print(f"LLM unavailable, using local fallback: {e}")
+                self.fallbacks += 1
+                text = self.fallback.generate(prompt)
+                produced = bool(text)
+                yield text
+            if not produced:
+                yield "Unable to generate insights at this time."
+
+        except Exception as e:
+            yield f"Error generating business insights: {str(e)}"
+
     def suggest_visualization_type(self, question: str, data: pd.DataFrame) -> str:
         """Suggest appropriate visualization type based on question and data"""
         try:
@@ -121,8 +260,7 @@ class AIService:
             Return only the name.
             """
 
-            response = self.model.generate_content(prompt)
-            viz_type = response.text.strip().lower() if response.text else 'bar'
+            viz_type = self._generate(prompt)[0].strip().lower() or 'bar'
             valid_types = ['bar', 'line', 'pie', 'scatter', 'histogram', 'box', 'area']
 
             return viz_type if viz_type in valid_types else 'bar'
@@ -133,8 +271,12 @@ class AIService:
     def test_api_connection(self) -> bool:
         """Test connection to Gemini API"""
         try:
-            response = self.model.generate_content("Say 'API Working'")
-            return response.text and "API Working" in response.text
+            return "API Working" in self.backend.generate("Say 'API Working'")
         except Exception:
             return False
 
+
+    def stats(self) -> Dict[str, Any]:
+        """Backend call counters (retries, circuit trips, throttling) and local fallbacks"""
+        stats = self.backend.stats() if hasattr(self.backend, 'stats') else {'backend': self.backend.name}
+        return {**stats, 'fallbacks': self.fallbacks, 'sql': dict(self.sql_counters)}
@@ -0,0 +1,103 @@
+import sqlite3
+import time
+import pandas as pd
+from typing import Dict, List, Any, Optional
+
+class BulkLoader:
+    def __init__(self, batch_size: int = 50000):
+        """Initialize bulk loader"""
+        self.batch_size = batch_size
+
+    @staticmethod
+    def sqlite_type(series: pd.Series) -> str:
+        """Declared SQLite column type for a pandas column"""
+        if pd.api.types.is_bool_dtype(series) or pd.api.types.is_integer_dtype(series):
+            return 'INTEGER'
+        if pd.api.types.is_float_dtype(series):
+            return 'REAL'
+        if pd.api.types.is_datetime64_any_dtype(series):
+            return 'TIMESTAMP'
+        return 'TEXT'
+
+    @staticmethod
+    def to_sqlite_columns(df: pd.DataFrame) -> List[list]:
+        """Convert dataframe columns to lists of SQLite-bindable Python values"""
+        columns = []
+        for col in df.columns:
+            series = df[col]
+            if pd.api.types.is_datetime64_any_dtype(series):
+                # Same text form as sqlite3's datetime adapter: microseconds only when non-zero
+                series = series.dt.strftime('%Y-%m-%d %H:%M:%S.%f').str.replace(r'\.000000$', '', regex=True)
+            values = series.astype(object).where(series.notna(), None).tolist()
+            columns.append(values)
+        return columns
+
+    def create_table_sql(self, df: pd.DataFrame, table_name: str, if_not_exists: bool = False) -> str:
+        """CREATE TABLE statement with explicit column types"""
+        columns = ", ".join(f'"{col}" {self.sqlite_type(df[col])}' for col in df.columns)
+        return f'CREATE TABLE {"IF NOT EXISTS " if if_not_exists else ""}"{table_name}" ({columns})'
+
+    def _set_load_pragmas(self, conn: sqlite3.Connection) -> Dict[str, Any]:
+        """Switch to unsafe-but-fast settings for the load, returning the previous values"""
+        previous = {
+            'synchronous': conn.execute("PRAGMA synchronous").fetchone()[0],
+            'journal_mode': conn.execute("PRAGMA journal_mode").fetchone()[0],
+        }
+        conn.execute("PRAGMA synchronous = OFF")
+        # Leaving WAL needs exclusive access; if other readers hold it we simply stay in WAL
+        try:
+            conn.execute("PRAGMA journal_mode = MEMORY")
+        except sqlite3.OperationalError:
+            pass
+        return previous
+
+    def _restore_pragmas(self, conn: sqlite3.Connection, previous: Dict[str, Any]) -> None:
+        """Restore the settings captured before the load"""
+        try:
+            conn.execute(f"PRAGMA journal_mode = {previous['journal_mode']}")
+        except sqlite3.OperationalError:
+            pass
+        conn.execute(f"PRAGMA synchronous = {previous['synchronous']}")
+
+    def load(self, conn: sqlite3.Connection, df: pd.DataFrame, table_name: str,
+             indexes: Optional[List[List[str]]] = None, replace: bool = True) -> Dict[str, Any]:
+        """Replace (or append to) a table with the dataframe in a single transaction, then build indexes"""
+        start = time.perf_counter()
+        if conn.in_transaction:
+            conn.commit()
+        previous = self._set_load_pragmas(conn)
+        try:
+            conn.execute("BEGIN")
+            try:
+                if replace:
+                    conn.execute(f'DROP TABLE IF EXISTS "{table_name}"')
+                conn.execute(self.create_table_sql(df, table_name, if_not_exists=not replace))
+                column_list = ", ".join(f'"{col}"' for col in df.columns)
+                insert_sql = (
+                    f'INSERT INTO "{table_name}" ({column_list}) VALUES ({", ".join("?" * len(df.columns))})'
+                )
+                for batch_start in range(0, len(df), self.batch_size):
+                    batch = df.iloc[batch_start:batch_start + self.batch_size]
+                    conn.executemany(insert_sql, zip(*self.to_sqlite_columns(batch)))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            load_seconds = time.perf_counter() - start
+
+            # Building indexes once over loaded data is much cheaper than maintaining them per insert
+            for columns in indexes or []:
+                index_name = f"ix_{table_name}_{'_'.join(columns)}"
+                column_list = ", ".join(f'"{col}"' for col in columns)
+                conn.execute(f'CREATE INDEX IF NOT EXISTS "{index_name}" ON "{table_name}" ({column_list})')
+            conn.commit()
+        finally:
+            self._restore_pragmas(conn, previous)
+
+        total_seconds = time.perf_counter() - start
+        return {
+            'rows': len(df),
+            'load_seconds': load_seconds,
+            'total_seconds': total_seconds,
+            'rows_per_sec': len(df) / load_seconds if load_seconds > 0 else float(len(df))
+        }
@@ -0,0 +1,109 @@
+import sqlite3
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Any, Optional, Iterator
+
+class ColumnarReader:
+    def __init__(self, cursor: sqlite3.Cursor, declared_types: Optional[Dict[str, str]] = None,
+                 chunk_size: int = 10000, max_rows: Optional[int] = None):
+        """Read a cursor's rows in chunks straight into typed NumPy column buffers"""
+        self.cursor = cursor
+        self.columns = [description[0] for description in cursor.description]
+        self.chunk_size = chunk_size
+        self.max_rows = max_rows
+        self.rows_read = 0
+        self.truncated = False
+
+        declared_types = {k.lower(): v for k, v in (declared_types or {}).items()}
+        self.kinds = [self._affinity(declared_types.get(col.lower(), '')) for col in self.columns]
+
+    @staticmethod
+    def _affinity(declared_type: str) -> str:
+        """Map a declared SQLite column type to a buffer kind using SQLite's affinity rules"""
+        declared_type = declared_type.upper()
+        if 'INT' in declared_type:
+            return 'int'
+        if any(token in declared_type for token in ('CHAR', 'CLOB', 'TEXT')):
+            return 'text'
+        if any(token in declared_type for token in ('REAL', 'FLOA', 'DOUB')):
+            return 'float'
+        return 'infer'
+
+    @staticmethod
+    def _to_array(values: tuple, kind: str) -> np.ndarray:
+        """Convert one chunk of a column to the narrowest safe NumPy dtype
+
+        The declared type is only a hint: result columns are matched to table columns by
+        name, so an aliased expression (e.g. AVG(clicks) AS clicks) carries the wrong
+        one. The chunk's actual value types decide, and floats are never cast to int.
+        """
+        types = {type(v) for v in values if v is not None}
+        if types == {int}:
+            kind = 'int'
+        elif types and types <= {int, float}:
+            kind = 'float'
+        elif types:
+            kind = 'text'
+
+        if kind == 'int':
+            try:
+                return np.array(values, dtype=np.int64)
+            except (TypeError, ValueError, OverflowError):
+                kind = 'float'  # NULLs present, fall back to float64 with NaN
+        if kind == 'float':
+            try:
+                return np.array(values, dtype=np.float64)
+            except (TypeError, ValueError):
+                pass
+        array = np.empty(len(values), dtype=object)
+        array[:] = values
+        return array
+
+    def _fetch_chunk(self) -> List[tuple]:
+        """Fetch the next chunk honouring the row cap"""
+        size = self.chunk_size
+        if self.max_rows is not None:
+            size = min(size, self.max_rows - self.rows_read)
+            if size <= 0:
+                self.truncated = self.cursor.fetchone() is not None
+                return []
+        rows = self.cursor.fetchmany(size)
+        self.rows_read += len(rows)
+        return rows
+
+    def _chunk_columns(self, rows: List[tuple]) -> List[np.ndarray]:
+        """Transpose a chunk of rows into per-column arrays"""
+        return [self._to_array(values, kind) for values, kind in zip(zip(*rows), self.kinds)]
+
+    def iter_frames(self) -> Iterator[pd.DataFrame]:
+        """Yield one DataFrame per chunk"""
+        while True:
+            rows = self._fetch_chunk()
+            if not rows:
+                return
+            arrays = self._chunk_columns(rows)
+            del rows
+            yield pd.DataFrame(dict(zip(range(len(arrays)), arrays)), copy=False).set_axis(self.columns, axis=1)
+
+    def read_frame(self) -> pd.DataFrame:
+        """Read every chunk and return a single DataFrame"""
+        buffers: List[List[np.ndarray]] = [[] for _ in self.columns]
+        while True:
+            rows = self._fetch_chunk()
+            if not rows:
+                break
+            for buffer, array in zip(buffers, self._chunk_columns(rows)):
+                buffer.append(array)
+            del rows
+
+        data: Dict[Any, np.ndarray] = {}
+        for i, (buffer, kind) in enumerate(zip(buffers, self.kinds)):
+            if not buffer:
+                data[i] = np.empty(0, dtype=np.float64 if kind in ('int', 'float') else object)
+            elif len(buffer) == 1:
+                data[i] = buffer[0]
+            else:
+                data[i] = np.concatenate(buffer)
+        frame = pd.DataFrame(data, copy=False).set_axis(self.columns, axis=1)
+        frame.attrs['truncated'] = self.truncated
+        return frame
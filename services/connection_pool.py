@@ -0,0 +1,154 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from urllib.parse import quote
+from typing import Dict, Any, Optional
+
+# PRAGMAs applied to every pooled connection. cache_size is negative so SQLite
+# reads it as KiB rather than pages.
+DEFAULT_PRAGMAS = {
+    'cache_size': -64000,        # ~64 MB page cache per connection
+    'mmap_size': 268435456,      # 256 MB memory-mapped I/O
+    'temp_store': 'MEMORY',
+    'synchronous': 'NORMAL',
+    'foreign_keys': 'ON',
+}
+
+# Read-side PRAGMAs that also apply to read-only connections
+SANDBOX_PRAGMAS = ('cache_size', 'mmap_size', 'temp_store')
+
+# Actions a sandboxed statement may perform: plain reads, (recursive) CTEs and functions
+SANDBOX_ACTIONS = {sqlite3.SQLITE_SELECT, sqlite3.SQLITE_READ, sqlite3.SQLITE_FUNCTION, sqlite3.SQLITE_RECURSIVE}
+SANDBOX_DENIED_FUNCTIONS = {'load_extension'}
+
+def sandbox_authorizer(action: int, arg1: Optional[str], arg2: Optional[str],
+                       db_name: Optional[str], trigger: Optional[str]) -> int:
+    """Allow only read actions; PRAGMA, ATTACH, transactions and every write are denied at compile time"""
+    if action not in SANDBOX_ACTIONS:
+        return sqlite3.SQLITE_DENY
+    if action == sqlite3.SQLITE_FUNCTION and (arg2 or '').lower() in SANDBOX_DENIED_FUNCTIONS:
+        return sqlite3.SQLITE_DENY
+    return sqlite3.SQLITE_OK
+
+class ConnectionPool:
+    def __init__(self, db_path: str, pragmas: Optional[Dict[str, Any]] = None, wal: bool = True,
+                 timeout: float = 30.0):
+        """Initialize a pool with per-thread read connections and a single writer
+
+        sandbox() hands out a second kind of per-thread reader for untrusted SQL: opened
+        with mode=ro and restricted by an authorizer, so it cannot write even by mistake.
+        """
+        self.db_path = db_path
+        self.pragmas = dict(DEFAULT_PRAGMAS)
+        if pragmas:
+            self.pragmas.update(pragmas)
+        self.wal = wal
+        self.timeout = timeout
+
+        self._lock = threading.Lock()
+        self._write_lock = threading.RLock()
+        self._readers: Dict[threading.Thread, sqlite3.Connection] = {}
+        self._sandboxes: Dict[threading.Thread, sqlite3.Connection] = {}
+        self._writer: Optional[sqlite3.Connection] = None
+        self._closed = False
+
+    def _connect(self) -> sqlite3.Connection:
+        """Open a new connection with the configured PRAGMAs applied"""
+        conn = sqlite3.connect(self.db_path, timeout=self.timeout, check_same_thread=False)
+        if self.wal:
+            conn.execute("PRAGMA journal_mode = WAL")
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        return conn
+
+    def _connect_sandbox(self) -> sqlite3.Connection:
+        """Open a read-only connection that only authorizes reads"""
+        uri = f"file:{quote(os.path.abspath(self.db_path))}?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, timeout=self.timeout, check_same_thread=False)
+        for name in SANDBOX_PRAGMAS:
+            if name in self.pragmas:
+                conn.execute(f"PRAGMA {name} = {self.pragmas[name]}")
+        conn.set_authorizer(sandbox_authorizer)
+        return conn
+
+    def _prune_dead_readers(self) -> None:
+        """Close read connections owned by threads that have exited (caller holds _lock)"""
+        for connections in (self._readers, self._sandboxes):
+            for thread in [t for t in connections if not t.is_alive()]:
+                try:
+                    connections.pop(thread).close()
+                except Exception:
+                    pass
+
+    @contextmanager
+    def reader(self):
+        """Yield the calling thread's read connection, creating it on first use"""
+        thread = threading.current_thread()
+        with self._lock:
+            if self._closed:
+                raise Exception("Connection pool is closed")
+            conn = self._readers.get(thread)
+            if conn is None:
+                self._prune_dead_readers()
+                conn = self._connect()
+                self._readers[thread] = conn
+        yield conn
+
+    @contextmanager
+    def sandbox(self):
+        """Yield the calling thread's read-only, authorizer-restricted connection"""
+        thread = threading.current_thread()
+        with self._lock:
+            if self._closed:
+                raise Exception("Connection pool is closed")
+            conn = self._sandboxes.get(thread)
+            if conn is None:
+                self._prune_dead_readers()
+                conn = self._connect_sandbox()
+                self._sandboxes[thread] = conn
+        yield conn
+
+    @contextmanager
+    def writer(self):
+        """Yield the shared write connection, serialized across threads"""
+        with self._write_lock:
+            with self._lock:
+                if self._closed:
+                    raise Exception("Connection pool is closed")
+                if self._writer is None:
+                    self._writer = self._connect()
+            conn = self._writer
+            try:
+                yield conn
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the number of open connections"""
+        with self._lock:
+            return {
+                'readers': len(self._readers),
+                'sandboxes': len(self._sandboxes),
+                'writer': self._writer is not None,
+                'closed': self._closed
+            }
+
+    def close(self) -> None:
+        """Close every pooled connection"""
+        with self._write_lock:
+            with self._lock:
+                self._closed = True
+                connections = list(self._readers.values()) + list(self._sandboxes.values())
+                if self._writer is not None:
+                    connections.append(self._writer)
+                self._readers.clear()
+                self._sandboxes.clear()
+                self._writer = None
+        for conn in connections:
+            try:
+                conn.close()
+            except Exception:
+                pass
@@ -0,0 +1,140 @@
+import io
+import re
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Any, Optional, Iterable, Iterator
+
+# Columns that hold repeated labels and are cheaper as categoricals
+CATEGORY_COLUMNS = {'message', 'eligibility'}
+INT32_MIN, INT32_MAX = np.iinfo(np.int32).min, np.iinfo(np.int32).max
+
+class DataCleaner:
+    def __init__(self, sample_rows: int = 10000, category_ratio: float = 0.5, max_categories: int = 1000,
+                 float_dtype: str = 'float64'):
+        """Initialize cleaner that plans column types once and applies them vectorized
+
+        float_dtype can be set to 'float32' to halve memory for metric columns at the
+        cost of precision on monetary values.
+        """
+        self.sample_rows = sample_rows
+        self.category_ratio = category_ratio
+        self.max_categories = max_categories
+        self.float_dtype = float_dtype
+
+    @staticmethod
+    def standardize_column(name: Any) -> str:
+        """Standardize a column name to lower snake case"""
+        return (
+            str(name).strip().lower()
+            .replace(' ', '_')
+            .replace('(', '')
+            .replace(')', '')
+            .replace('-', '_')
+            .replace('.', '_')
+        )
+
+    def infer_plan(self, sample: pd.DataFrame) -> Dict[str, str]:
+        """Decide a target kind per column from a sample: int, float, datetime, category or text"""
+        sample = sample.head(self.sample_rows)
+        plan = {}
+        for col in sample.columns:
+            name = self.standardize_column(col)
+            series = sample[col]
+            if pd.api.types.is_datetime64_any_dtype(series):
+                plan[name] = 'datetime'
+                continue
+            if pd.api.types.is_bool_dtype(series):
+                plan[name] = 'int'
+                continue
+
+            numeric = series if pd.api.types.is_numeric_dtype(series) else pd.to_numeric(series, errors='coerce')
+            if numeric.notna().any():
+                values = numeric.dropna().to_numpy(dtype=np.float64)
+                plan[name] = 'int' if np.all(np.mod(values, 1) == 0) else 'float'
+                continue
+
+            non_null = series.dropna()
+            if 'date' in name and len(non_null) > 0 and \
+                    pd.to_datetime(non_null, errors='coerce', format='mixed').notna().all():
+                plan[name] = 'datetime'
+                continue
+
+            unique = non_null.nunique()
+            if name in CATEGORY_COLUMNS or (
+                len(non_null) > 0 and unique <= self.max_categories and unique / len(non_null) <= self.category_ratio
+            ):
+                plan[name] = 'category'
+            else:
+                plan[name] = 'text'
+        return plan
+
+    def _convert(self, series: pd.Series, kind: str) -> pd.Series:
+        """Convert one column to its planned kind, filling gaps like the original cleaner"""
+        if kind in ('int', 'float'):
+            numeric = series if pd.api.types.is_numeric_dtype(series) else pd.to_numeric(series, errors='coerce')
+            numeric = numeric.fillna(0)
+            if kind == 'int':
+                values = numeric.to_numpy(dtype=np.float64)
+                if len(values) == 0 or (np.all(np.mod(values, 1) == 0)
+                                        and values.min() >= INT32_MIN and values.max() <= INT32_MAX):
+                    return numeric.astype(np.int32)
+                if np.all(np.mod(values, 1) == 0):
+                    return numeric.astype(np.int64)
+            return numeric.astype(self.float_dtype)
+        if kind == 'datetime':
+            if pd.api.types.is_datetime64_any_dtype(series):
+                return series
+            return pd.to_datetime(series, errors='coerce', format='mixed')
+        text = series.astype(object).where(series.notna(), 'Unknown')
+        if kind == 'category':
+            return text.astype(str).astype('category')
+        return text
+
+    def apply_plan(self, df: pd.DataFrame, plan: Dict[str, str]) -> pd.DataFrame:
+        """Apply a type plan in one pass, building the cleaned frame column by column"""
+        df = df.dropna(how='all')
+        df.columns = [self.standardize_column(col) for col in df.columns]
+        return pd.DataFrame(
+            {col: self._convert(df[col], plan.get(col, 'text')) for col in df.columns},
+            index=df.index
+        )
+
+    def clean(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Clean a whole dataframe in memory"""
+        df = df.dropna(how='all').dropna(axis=1, how='all')
+        return self.apply_plan(df, self.infer_plan(df))
+
+    def clean_chunks(self, chunks: Iterable[pd.DataFrame]) -> Iterator[pd.DataFrame]:
+        """Clean a stream of chunks, inferring the plan from the first one"""
+        plan: Optional[Dict[str, str]] = None
+        categories: Dict[str, List[Any]] = {}
+        for chunk in chunks:
+            if plan is None:
+                plan = self.infer_plan(chunk)
+            cleaned = self.apply_plan(chunk, plan)
+            # Keep category codes stable across chunks so they concatenate without upcasting
+            for col in cleaned.columns:
+                if plan.get(col) == 'category':
+                    known = categories.setdefault(col, [])
+                    seen = set(known)
+                    known.extend(c for c in cleaned[col].cat.categories if c not in seen)
+                    cleaned[col] = cleaned[col].cat.set_categories(known)
+            yield cleaned
+
+    @staticmethod
+    def read_chunks(source: Any, chunksize: int = 100000, name: str = "") -> Iterator[pd.DataFrame]:
+        """Read a CSV, XLSX or Parquet file in bounded-memory chunks"""
+        from services.file_reader import FileReader
+
+        name = (name or FileReader.file_name(source)).lower()
+        if isinstance(source, bytes):
+            source = io.BytesIO(source)
+        if re.search(r"\.csv(\.gz)?$", name):
+            yield from pd.read_csv(source, chunksize=chunksize)
+        elif name.endswith('.parquet'):
+            import pyarrow.parquet as pq
+            for batch in pq.ParquetFile(source).iter_batches(batch_size=chunksize):
+                yield batch.to_pandas()
+        else:
+            # openpyxl read-only mode streams rows instead of building the whole sheet
+            yield from FileReader.iter_xlsx_chunks(source, chunksize=chunksize)
@@ -1,35 +1,125 @@
+import multiprocessing
 import pandas as pd
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pickle import PicklingError
 from typing import Dict, Any
 from services.database_service import DatabaseService
+from services.data_cleaner import DataCleaner
+from services.file_reader import FileReader
+from services.ingest_cache import IngestCache
+
+# Upload keys and the tables they load into
+FILE_TABLES = {
+    'ad_sales': 'ad_sales_metrics',
+    'total_sales': 'total_sales_metrics',
+    'eligibility': 'eligibility_table',
+}
+
+# Natural keys and watermark column used for incremental loads
+TABLE_KEYS = {
+    'ad_sales_metrics': (['date', 'item_id'], 'date'),
+    'total_sales_metrics': (['date', 'item_id'], 'date'),
+    'eligibility_table': (['eligibility_datetime_utc', 'item_id'], 'eligibility_datetime_utc'),
+}
 
 class DataLoader:
-    def __init__(self):
-        """Initialize data loader"""
-        pass
+    def __init__(self, chunked_threshold_bytes: int = 50 * 1024 * 1024):
+        """Initialize data loader
+
+        Uploads larger than chunked_threshold_bytes are streamed through load_file_chunked.
+        """
+        self.chunked_threshold_bytes = chunked_threshold_bytes
+        self.cleaner = DataCleaner()
+        self.ingest_cache = IngestCache()
     
-    def load_uploaded_data(self, files: Dict[str, Any], db_service: DatabaseService) -> None:
-        """Load uploaded Excel files into database"""
+    def _store_dataframe(self, df: pd.DataFrame, table_name: str, db_service: DatabaseService,
+                         incremental: bool) -> None:
+        """Replace the table, or upsert on its natural key when loading incrementally"""
+        if incremental and table_name in TABLE_KEYS:
+            key_columns, watermark_column = TABLE_KEYS[table_name]
+            db_service.upsert_dataframe(df, table_name, key_columns, watermark_column=watermark_column)
+        else:
+            db_service.create_table_from_dataframe(df, table_name)
+    
+    def parse_files(self, files: Dict[str, Any], use_processes: bool = True) -> Dict[str, Dict[str, Any]]:
+        """Read and clean several files concurrently, returning each dataframe with its timings"""
+        payloads = {
+            key: (FileReader.file_name(source), FileReader.to_payload(source))
+            for key, source in files.items()
+        }
+        parsed = {}
+        
+        # Unchanged files are recognized by content hash and loaded from the ingest cache
+        hashes = {}
+        for key, (name, payload) in list(payloads.items()):
+            start = time.perf_counter()
+            hashes[key] = IngestCache.content_hash(payload, name)
+            df = self.ingest_cache.get(hashes[key])
+            if df is not None:
+                parsed[key] = {'dataframe': df, 'parse_seconds': time.perf_counter() - start,
+                               'clean_seconds': 0.0, 'cached': True}
+                del payloads[key]
+        
         try:
-            # Process Ad Sales and Metrics
-            if 'ad_sales' in files:
-                ad_sales_df = pd.read_excel(files['ad_sales'])
-                ad_sales_df = self.clean_dataframe(ad_sales_df)
-                db_service.create_table_from_dataframe(ad_sales_df, 'ad_sales_metrics')
-            
-            # Process Total Sales and Metrics
-            if 'total_sales' in files:
-                total_sales_df = pd.read_excel(files['total_sales'])
-                total_sales_df = self.clean_dataframe(total_sales_df)
-                db_service.create_table_from_dataframe(total_sales_df, 'total_sales_metrics')
-            
-            # Process Eligibility Table
-            if 'eligibility' in files:
-                eligibility_df = pd.read_excel(files['eligibility'])
-                eligibility_df = self.clean_dataframe(eligibility_df)
-                db_service.create_table_from_dataframe(eligibility_df, 'eligibility_table')
+            if payloads:
+                workers = max(len(payloads), 1)
+                # Spawned, not forked: forking the multi-threaded Streamlit server can deadlock the child
+                executor = (ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+                            if use_processes else ThreadPoolExecutor(max_workers=workers))
+                with executor:
+                    futures = [
+                        executor.submit(FileReader.parse_and_clean, key, name, payload)
+                        for key, (name, payload) in payloads.items()
+                    ]
+                    for future in futures:
+                        key, df, timings = future.result()
+                        parsed[key] = {'dataframe': df, **timings}
+        except (BrokenProcessPool, OSError, PicklingError) as e:
+            # Process pools can be unavailable (restricted hosts, some Streamlit deployments)
+            print(f"Parallel parsing unavailable ({str(e)}), parsing serially")
+            for key, (name, payload) in payloads.items():
+                _, df, timings = FileReader.parse_and_clean(key, name, payload)
+                parsed[key] = {'dataframe': df, **timings}
+        
+        for key in payloads:
+            self.ingest_cache.put(hashes[key], parsed[key]['dataframe'])
+            parsed[key]['cached'] = False
+        
+        return parsed
+    
+    def load_uploaded_data(self, files: Dict[str, Any], db_service: DatabaseService, incremental: bool = False,
+                           use_processes: bool = True) -> Dict[str, Dict[str, float]]:
+        """Load uploaded Excel, CSV or Parquet files into database"""
+        try:
+            # Parse and clean all files in parallel, then write them through the single writer
+            files = {key: source for key, source in files.items() if key in FILE_TABLES}
+            large = {key: source for key, source in files.items()
+                     if FileReader.source_size(source) > self.chunked_threshold_bytes}
+            parsed = self.parse_files({key: source for key, source in files.items() if key not in large},
+                                      use_processes=use_processes)
+            
+            timings = {}
+            # Large files are streamed chunk by chunk instead of being parsed whole in a worker
+            for key, source in large.items():
+                table_name = FILE_TABLES[key]
+                timings[table_name] = self.load_file_chunked(source, table_name, db_service,
+                                                             incremental=incremental)
+                print(f"{table_name}: streamed {timings[table_name]['rows']} rows in "
+                      f"{timings[table_name]['chunks']} chunks")
+            for key, result in parsed.items():
+                table_name = FILE_TABLES[key]
+                start = time.perf_counter()
+                self._store_dataframe(result.pop('dataframe'), table_name, db_service, incremental)
+                result['store_seconds'] = time.perf_counter() - start
+                timings[table_name] = result
+                print(f"{table_name}: parsed in {result['parse_seconds']:.2f}s, "
+                      f"cleaned in {result['clean_seconds']:.2f}s, stored in {result['store_seconds']:.2f}s")
             
             print("All files processed and loaded into database successfully!")
+            return timings
             
         except Exception as e:
             raise Exception(f"Error loading uploaded data: {str(e)}")
@@ -82,36 +172,49 @@ class DataLoader:
     def clean_dataframe(self, df: pd.DataFrame) -> pd.DataFrame:
         """Clean and standardize dataframe"""
         try:
-            # Remove completely empty rows and columns
-            df = df.dropna(how='all').dropna(axis=1, how='all')
-            
-            # Standardize column names
-            df.columns = [
-                col.strip().lower()
-                .replace(' ', '_')
-                .replace('(', '')
-                .replace(')', '')
-                .replace('-', '_')
-                .replace('.', '_')
-                for col in df.columns
-            ]
-            
-            # Convert numeric columns
-            for col in df.columns:
-                if df[col].dtype == 'object':
-                    # Try to convert to numeric
-                    numeric_series = pd.to_numeric(df[col], errors='coerce')
-                    if not pd.isna(numeric_series).all():
-                        df[col] = numeric_series
-            
-            # Fill NaN values appropriately
-            for col in df.columns:
-                if df[col].dtype in ['float64', 'int64']:
-                    df[col] = df[col].fillna(0)
-                else:
-                    df[col] = df[col].fillna('Unknown')
-            
-            return df
-            
+            return self.cleaner.clean(df)
         except Exception as e:
             raise Exception(f"Error cleaning dataframe: {str(e)}")
+    
+    def load_file_chunked(self, source: Any, table_name: str, db_service: DatabaseService,
+                          chunksize: int = 100000, incremental: bool = False) -> Dict[str, float]:
+        """Stream a large export into a table, cleaning it chunk by chunk in bounded memory
+
+        Replace loads create the table from the first chunk and append the rest; incremental
+        loads upsert every chunk on the table's natural key. Returns per-stage timings.
+        """
+        try:
+            timings = {'parse_seconds': 0.0, 'clean_seconds': 0.0, 'store_seconds': 0.0,
+                       'rows': 0, 'chunks': 0, 'cached': False}
+            raw = self.cleaner.read_chunks(source, chunksize=chunksize)
+
+            def timed_read():
+                while True:
+                    start = time.perf_counter()
+                    chunk = next(raw, None)
+                    timings['parse_seconds'] += time.perf_counter() - start
+                    if chunk is None:
+                        return
+                    yield chunk
+
+            chunks = self.cleaner.clean_chunks(timed_read())
+            while True:
+                # Pulling a cleaned chunk also reads it; subtract the read time measured above
+                start, parse_before = time.perf_counter(), timings['parse_seconds']
+                chunk = next(chunks, None)
+                elapsed = time.perf_counter() - start
+                timings['clean_seconds'] += elapsed - (timings['parse_seconds'] - parse_before)
+                if chunk is None:
+                    break
+
+                start = time.perf_counter()
+                if timings['chunks'] == 0 or (incremental and table_name in TABLE_KEYS):
+                    self._store_dataframe(chunk, table_name, db_service, incremental)
+                else:
+                    db_service.append_dataframe(chunk, table_name)
+                timings['store_seconds'] += time.perf_counter() - start
+                timings['rows'] += len(chunk)
+                timings['chunks'] += 1
+            return timings
+        except Exception as e:
+            raise Exception(f"Error loading {table_name} in chunks: {str(e)}")
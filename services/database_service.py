@@ -1,71 +1,666 @@
 import sqlite3
+import hashlib
+import re
+import json
+import threading
+from contextlib import nullcontext
 import pandas as pd
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Callable, Iterator, Tuple
 import os
+from services.connection_pool import ConnectionPool
+from services.columnar_reader import ColumnarReader
+from services.bulk_loader import BulkLoader
+from services.index_advisor import IndexAdvisor
+from services.rollup_service import RollupService, FACT_MEASURES
+from services.result_cache import ResultCache
+from services.schema_catalog import SchemaCatalog
+from services.query_guard import QueryGuard, QueryCancelled, QueryTooExpensive, QueryNotAllowed
+
+# User-visible tables; names starting with an underscore hold internal metadata
+USER_TABLES_SQL = "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%' AND name NOT LIKE '\\_%' ESCAPE '\\'"
+
+# Statements generated from questions must start with one of these
+READ_ONLY_KEYWORDS = ('SELECT', 'WITH', 'VALUES')
+# Leading "-- ..." and "/* ... */" comments, which models often put before the statement
+LEADING_COMMENTS_RE = re.compile(r"^(?:\s*(?:--[^\n]*(?:\n|$)|/\*.*?\*/))*", re.DOTALL)
+# VDBE opcodes that only appear in programs that change the database file or schema
+# (sorters and DISTINCT write to ephemeral tables, which use OpenEphemeral instead)
+WRITE_OPCODES = {'OpenWrite', 'Destroy', 'Clear', 'CreateBtree', 'SetCookie', 'ParseSchema',
+                 'DropTable', 'DropIndex', 'DropTrigger', 'Vacuum', 'VBegin', 'VUpdate'}
 
 class DatabaseService:
-    def __init__(self, db_path: str = "ecommerce.db"):
-        """Initialize database service"""
+    def __init__(self, db_path: str = "ecommerce.db", pragmas: Optional[Dict[str, Any]] = None,
+                 result_cache_bytes: int = 64 * 1024 * 1024, max_result_rows: Optional[int] = 100000):
+        """Initialize database service
+
+        max_result_rows caps how many rows a single SELECT brings into memory; larger
+        results are truncated (flagged in the result) and can be paged with fetch_page.
+        """
         self.db_path = db_path
+        self.max_result_rows = max_result_rows
+        self.pool = ConnectionPool(db_path, pragmas=pragmas)
+        self.result_cache = ResultCache.for_database(os.path.abspath(db_path), max_bytes=result_cache_bytes)
+        self.rollups = RollupService(self.pool)
+        self.schema_catalog = SchemaCatalog(self)
+        self.query_guard = QueryGuard(
+            row_counts=lambda: {name: info['row_count'] for name, info in self.get_table_info().items()}
+        )
+        self.index_advisor = IndexAdvisor(self.pool, query_guard=self.query_guard)
+        self._table_listeners: List[Callable[[str], None]] = []
         self.init_database()
     
     def init_database(self):
         """Initialize the database connection"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                conn.execute("PRAGMA foreign_keys = ON")
+            with self.pool.writer() as conn:
+                conn.execute("SELECT 1")
                 print(f"Database initialized: {self.db_path}")
         except Exception as e:
             raise Exception(f"Failed to initialize database: {str(e)}")
     
-    def create_table_from_dataframe(self, df: pd.DataFrame, table_name: str) -> None:
+    def create_table_from_dataframe(self, df: pd.DataFrame, table_name: str,
+                                    indexes: Optional[List[List[str]]] = None) -> Dict[str, Any]:
         """Create table from pandas dataframe"""
+        if indexes is None:
+            indexes = IndexAdvisor.known_indexes(table_name, list(df.columns))
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                df.to_sql(table_name, conn, if_exists='replace', index=False)
-                print(f"Table '{table_name}' created with {len(df)} rows")
+            with self.pool.writer() as conn:
+                stats = BulkLoader().load(conn, df, table_name, indexes=indexes)
+                # A full replace invalidates any incremental load watermark
+                self._ensure_watermark_table(conn)
+                conn.execute("DELETE FROM _load_watermarks WHERE table_name = ?", (table_name,))
+                self._record_table_stats(conn, table_name, df)
+                print(f"Table '{table_name}' created with {len(df)} rows "
+                      f"({stats['rows_per_sec']:,.0f} rows/sec)")
         except Exception as e:
             raise Exception(f"Failed to create table {table_name}: {str(e)}")
+        self._bump_tables([table_name])
+        self._refresh_rollups(table_name)
+        self._notify_table_changed(table_name)
+        return stats
+    
+    def append_dataframe(self, df: pd.DataFrame, table_name: str) -> Dict[str, Any]:
+        """Append dataframe rows to a table, creating it if needed"""
+        try:
+            with self.pool.writer() as conn:
+                stats = BulkLoader().load(conn, df, table_name, replace=False)
+                self._record_table_stats(conn, table_name, df, append=True)
+                print(f"Table '{table_name}' appended {len(df)} rows "
+                      f"({stats['rows_per_sec']:,.0f} rows/sec)")
+        except Exception as e:
+            raise Exception(f"Failed to append to table {table_name}: {str(e)}")
+        self._bump_tables([table_name])
+        self._refresh_rollups(table_name, changed=df)
+        self._notify_table_changed(table_name)
+        return stats
+    
+    def _refresh_rollups(self, table_name: str, changed: Optional[pd.DataFrame] = None) -> None:
+        """Keep KPI rollups in step with a fact table: rebuild on replace, patch touched groups on appends"""
+        if table_name not in FACT_MEASURES:
+            return
+        try:
+            if changed is None:
+                refreshed = self.rollups.rebuild()
+            else:
+                try:
+                    refreshed = self.rollups.update(changed)
+                except sqlite3.OperationalError:
+                    # Rollup layout no longer matches the fact tables (e.g. a new measure table)
+                    refreshed = self.rollups.rebuild()
+            with self.pool.writer() as conn:
+                self._forget_table_stats(conn, refreshed)
+            self._bump_tables(refreshed)
+        except Exception as e:
+            print(f"Failed to refresh rollups after loading {table_name}: {str(e)}")
+    
+    def _ensure_watermark_table(self, conn: sqlite3.Connection) -> None:
+        """Create the internal load watermark table if missing"""
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS _load_watermarks (
+                table_name TEXT PRIMARY KEY,
+                watermark_column TEXT,
+                watermark TEXT,
+                rows_written INTEGER,
+                loaded_at TEXT
+            )
+        """)
+    
+    def _ensure_versions_table(self, conn: sqlite3.Connection) -> None:
+        """Create the internal per-table data version table if missing"""
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS _data_versions (
+                table_name TEXT PRIMARY KEY,
+                version INTEGER NOT NULL
+            )
+        """)
+    
+    def _bump_tables(self, table_names) -> None:
+        """Record a data change in the persisted table versions and drop cached results over the tables
+
+        The versions live in the database file, so processes sharing it (e.g. the app and
+        load_attached_data.py) see each other's loads; see _sync_table_versions.
+        """
+        table_names = [name.lower() for name in table_names]
+        if not table_names:
+            return
+        versions = {}
+        with self.pool.writer() as conn:
+            self._ensure_versions_table(conn)
+            for name in table_names:
+                versions[name] = conn.execute(
+                    "INSERT INTO _data_versions VALUES (?, 1) "
+                    "ON CONFLICT (table_name) DO UPDATE SET version = version + 1 RETURNING version", (name,)
+                ).fetchone()[0]
+        for name, version in versions.items():
+            self.result_cache.bump_table(name, persisted_version=version)
+    
+    def _sync_table_versions(self) -> None:
+        """Invalidate cached results over tables whose persisted version was bumped by another process"""
+        try:
+            with self.pool.reader() as conn:
+                rows = conn.execute("SELECT table_name, version FROM _data_versions").fetchall()
+        except sqlite3.OperationalError:
+            return  # Nothing has been loaded through a DatabaseService yet
+        self.result_cache.sync_versions(dict(rows))
+    
+    def _ensure_stats_table(self, conn: sqlite3.Connection) -> None:
+        """Create the internal table metadata table if missing"""
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS _table_stats (
+                table_name TEXT PRIMARY KEY,
+                row_count INTEGER,
+                byte_size INTEGER,
+                column_stats TEXT,
+                loaded_at TEXT
+            )
+        """)
+    
+    @staticmethod
+    def _column_stats(df: pd.DataFrame) -> Dict[str, Dict[str, Any]]:
+        """Null counts and min/max of numeric and datetime columns"""
+        stats = {}
+        for col in df.columns:
+            series = df[col]
+            col_stats: Dict[str, Any] = {'nulls': int(series.isna().sum())}
+            if series.notna().any():
+                if pd.api.types.is_datetime64_any_dtype(series):
+                    col_stats['min'], col_stats['max'] = str(series.min()), str(series.max())
+                elif pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+                    col_stats['min'], col_stats['max'] = series.min().item(), series.max().item()
+            stats[col] = col_stats
+        return stats
+    
+    def _record_table_stats(self, conn: sqlite3.Connection, table_name: str, df: pd.DataFrame,
+                            append: bool = False, row_count: Optional[int] = None) -> None:
+        """Store row count, size and column stats for loaded data, merging with existing stats on append"""
+        self._ensure_stats_table(conn)
+        column_stats = self._column_stats(df)
+        byte_size = int(df.memory_usage(index=False, deep=True).sum())
+        previous = conn.execute(
+            "SELECT row_count, byte_size, column_stats FROM _table_stats WHERE table_name = ?", (table_name,)
+        ).fetchone() if append else None
+        
+        if previous:
+            old_count, old_size, old_stats = previous[0], previous[1], json.loads(previous[2] or "{}")
+            for col, new in column_stats.items():
+                old = old_stats.get(col)
+                if not old:
+                    continue
+                new['nulls'] += old.get('nulls', 0)
+                if 'min' in old and 'min' in new:
+                    new['min'], new['max'] = min(old['min'], new['min']), max(old['max'], new['max'])
+            byte_size += old_size or 0
+            if row_count is None:
+                row_count = old_count + len(df)
+        elif append and row_count is None:
+            row_count = conn.execute(f'SELECT COUNT(*) FROM "{table_name}"').fetchone()[0]
+        
+        conn.execute(
+            "INSERT OR REPLACE INTO _table_stats VALUES (?, ?, ?, ?, datetime('now'))",
+            (table_name, len(df) if row_count is None else row_count, byte_size, json.dumps(column_stats))
+        )
+    
+    def _forget_table_stats(self, conn: sqlite3.Connection, table_names) -> None:
+        """Drop stored stats for tables changed outside the loader so they are recounted on next use"""
+        self._ensure_stats_table(conn)
+        conn.executemany("DELETE FROM _table_stats WHERE table_name = ?", [(t,) for t in table_names])
+    
+    def get_watermark(self, table_name: str) -> Optional[str]:
+        """Highest watermark value loaded so far for a table, if any"""
+        try:
+            with self.pool.reader() as conn:
+                row = conn.execute(
+                    "SELECT watermark FROM _load_watermarks WHERE table_name = ?", (table_name,)
+                ).fetchone()
+            return row[0] if row else None
+        except sqlite3.OperationalError:
+            return None
+    
+    def upsert_dataframe(self, df: pd.DataFrame, table_name: str, key_columns: List[str],
+                         watermark_column: Optional[str] = None, skip_before_watermark: bool = False,
+                         batch_size: int = 5000) -> Dict[str, int]:
+        """Insert new rows and update changed rows on the natural key, leaving unchanged rows untouched
+
+        Rows before the stored watermark are still upserted by default, so days restated
+        in a later export are picked up (unchanged rows cost no writes); pass
+        skip_before_watermark=True for append-only sources. Duplicate keys left by earlier
+        replace loads are removed once, when the unique key index is first built, and
+        reported as duplicates_removed.
+        """
+        try:
+            missing = [col for col in key_columns if col not in df.columns]
+            if missing:
+                raise ValueError(f"Key columns {missing} not found in data")
+            
+            df = df.drop_duplicates(subset=key_columns, keep='last')
+            watermark = self.get_watermark(table_name) if watermark_column else None
+            columns = BulkLoader.to_sqlite_columns(df)
+            col_names = list(df.columns)
+            
+            if watermark_column and watermark is not None and skip_before_watermark:
+                wm_values = columns[col_names.index(watermark_column)]
+                keep = [v is not None and str(v) >= watermark for v in wm_values]
+                columns = [[v for v, k in zip(values, keep) if k] for values in columns]
+                df = df[keep]
+            rows = list(zip(*columns)) if columns else []
+            
+            quoted = [f'"{col}"' for col in col_names]
+            keys = ", ".join(f'"{col}"' for col in key_columns)
+            value_cols = [f'"{col}"' for col in col_names if col not in key_columns]
+            if value_cols:
+                conflict = (
+                    "DO UPDATE SET " + ", ".join(f"{c} = excluded.{c}" for c in value_cols)
+                    + " WHERE " + " OR ".join(f'"{table_name}".{c} IS NOT excluded.{c}' for c in value_cols)
+                )
+            else:
+                conflict = "DO NOTHING"
+            upsert_sql = (
+                f'INSERT INTO "{table_name}" ({", ".join(quoted)}) VALUES ({", ".join("?" * len(quoted))}) '
+                f"ON CONFLICT ({keys}) {conflict}"
+            )
+            index_name = f"ux_{table_name}_{'_'.join(key_columns)}"
+            
+            with self.pool.writer() as conn:
+                exists = conn.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type='table' AND name = ?", (table_name,)
+                ).fetchone()
+                has_index = conn.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type='index' AND name = ?", (index_name,)
+                ).fetchone()
+                removed = 0
+                if not exists:
+                    conn.execute(BulkLoader().create_table_sql(df, table_name))
+                elif not has_index:
+                    # First incremental load after replace loads: drop duplicate keys (keeping the
+                    # latest row) so the unique index can be built; later loads skip this scan
+                    removed = conn.execute(f"""
+                        DELETE FROM "{table_name}" WHERE rowid NOT IN (
+                            SELECT MAX(rowid) FROM "{table_name}" GROUP BY {keys}
+                        )
+                    """).rowcount
+                    if removed:
+                        print(f"Table '{table_name}': removed {removed} rows with duplicate keys {key_columns}")
+                if not has_index:
+                    conn.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS "{index_name}" ON "{table_name}" ({keys})')
+                
+                before = conn.total_changes
+                for start in range(0, len(rows), batch_size):
+                    conn.executemany(upsert_sql, rows[start:start + batch_size])
+                written = conn.total_changes - before
+                
+                for columns in IndexAdvisor.known_indexes(table_name, col_names):
+                    column_list = ", ".join(f'"{col}"' for col in columns)
+                    conn.execute(
+                        f'CREATE INDEX IF NOT EXISTS "ix_{table_name}_{"_".join(columns)}" ON "{table_name}" ({column_list})'
+                    )
+                
+                if written or removed:
+                    # Updates and inserts are indistinguishable here; the unique index makes the recount cheap
+                    row_count = conn.execute(f'SELECT COUNT(*) FROM "{table_name}"').fetchone()[0]
+                    self._record_table_stats(conn, table_name, df, append=True, row_count=row_count)
+                
+                if watermark_column:
+                    self._ensure_watermark_table(conn)
+                    new_watermark = conn.execute(f'SELECT MAX("{watermark_column}") FROM "{table_name}"').fetchone()[0]
+                    conn.execute(
+                        "INSERT OR REPLACE INTO _load_watermarks VALUES (?, ?, ?, ?, datetime('now'))",
+                        (table_name, watermark_column, new_watermark, written)
+                    )
+            
+            print(f"Table '{table_name}' upserted: {written} of {len(rows)} candidate rows written")
+        except Exception as e:
+            raise Exception(f"Failed to upsert into table {table_name}: {str(e)}")
+        
+        if removed:
+            # Deleted duplicates can touch any key, so rebuild rollups from the whole table
+            self._refresh_rollups(table_name)
+        elif written:
+            self._refresh_rollups(table_name, changed=df)
+        if written or removed:
+            self._bump_tables([table_name])
+            self._notify_table_changed(table_name)
+        return {'candidate_rows': len(rows), 'rows_written': written, 'duplicates_removed': removed}
+    
+    def add_table_listener(self, callback: Callable[[str], None]) -> None:
+        """Register a callback invoked with the table name whenever a table is replaced"""
+        if callback not in self._table_listeners:
+            self._table_listeners.append(callback)
+    
+    def _notify_table_changed(self, table_name: str) -> None:
+        """Notify listeners that a table's contents changed"""
+        for callback in self._table_listeners:
+            try:
+                callback(table_name)
+            except Exception as e:
+                print(f"Table listener failed for {table_name}: {str(e)}")
+    
+    def get_schema_fingerprint(self) -> str:
+        """Hash of the table definitions, used to key caches derived from the schema"""
+        try:
+            with self.pool.reader() as conn:
+                rows = conn.execute(
+                    f"SELECT name, sql FROM sqlite_master WHERE name IN ({USER_TABLES_SQL}) ORDER BY name"
+                ).fetchall()
+            return hashlib.sha1(repr(rows).encode()).hexdigest()[:16]
+        except Exception:
+            return ""
+    
+    def _table_names(self) -> List[str]:
+        """Names of all user tables"""
+        with self.pool.reader() as conn:
+            rows = conn.execute(USER_TABLES_SQL).fetchall()
+        return [name for (name,) in rows]
+    
+    @staticmethod
+    def _statement(query: str) -> str:
+        """Query text without leading comments, surrounding whitespace and trailing semicolons"""
+        return LEADING_COMMENTS_RE.sub('', query).strip().rstrip(';').strip()
+    
+    @staticmethod
+    def _write_opcodes(conn: sqlite3.Connection, statement: str) -> List[str]:
+        """Write opcodes in the compiled program of a statement"""
+        program = conn.execute(f"EXPLAIN {statement}").fetchall()
+        return sorted({row[1] for row in program} & WRITE_OPCODES)
     
-    def execute_query(self, query: str) -> Optional[Dict[str, Any]]:
+    def _is_read_query(self, query: str) -> bool:
+        """Whether a trusted query only reads (a WITH ... SELECT counts, a WITH ... DELETE does not)"""
+        statement = self._statement(query)
+        if not statement or statement.split(None, 1)[0].upper() not in READ_ONLY_KEYWORDS:
+            return False
+        try:
+            with self.pool.reader() as conn:
+                return not self._write_opcodes(conn, statement)
+        except sqlite3.Error:
+            # Let execution report the real error on the read path
+            return True
+    
+    def validate_sql(self, query: str) -> Optional[str]:
+        """Check a generated query without running it; returns an error message, or None if valid
+
+        The query must be a single read-only statement that compiles against the live
+        schema (EXPLAIN reports unknown tables and columns exactly like execution
+        would), contains no write opcodes, and passes the query guard's plan check. It
+        compiles on the sandbox connection, so anything execution would refuse fails here.
+        """
+        statement = self._statement(query)
+        if not statement:
+            return "The query is empty."
+        keyword = statement.split(None, 1)[0].upper()
+        if keyword not in READ_ONLY_KEYWORDS:
+            return f"Only read-only SELECT queries are allowed, but the query starts with {keyword}."
+        try:
+            with self.pool.sandbox() as conn:
+                # Raises for unknown tables/columns, syntax errors, multiple statements and
+                # anything the sandbox's authorizer refuses
+                writes = self._write_opcodes(conn, statement)
+                if writes:
+                    return f"The query modifies the database ({', '.join(writes)}); only reads are allowed."
+                self.query_guard.preflight(conn, statement)
+        except QueryTooExpensive as e:
+            return str(e)
+        except (sqlite3.Error, sqlite3.Warning) as e:
+            if isinstance(e, sqlite3.Error) and self._is_sandbox_violation(e):
+                return f"The query is not allowed on the read-only connection ({e}); use a single plain SELECT."
+            return f"SQLite error: {e}"
+        return None
+    
+    def execute_query(self, query: str, use_cache: bool = True) -> Optional[Dict[str, Any]]:
         """Execute SQL query and return results"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute(query)
+            tables = ResultCache.referenced_tables(query, self._table_names())
+            
+            # For read queries (SELECT, WITH ... SELECT, VALUES)
+            if self._is_read_query(query):
+                self._sync_table_versions()
+                cache_key = self.result_cache.make_key(query, tables)
+                if use_cache:
+                    cached = self.result_cache.get(cache_key)
+                    if cached is not None:
+                        return cached
                 
-                # For SELECT queries
-                if query.strip().upper().startswith('SELECT'):
+                with self.pool.reader() as conn:
+                    cursor = conn.cursor()
+                    cursor.execute(query)
                     columns = [description[0] for description in cursor.description]
-                    data = cursor.fetchall()
-                    return {
+                    if self.max_result_rows is None:
+                        data, truncated = cursor.fetchall(), False
+                    else:
+                        data = cursor.fetchmany(self.max_result_rows)
+                        truncated = len(data) == self.max_result_rows and cursor.fetchone() is not None
+                    cursor.close()
+                    result = {
                         'columns': columns,
                         'data': data,
-                        'row_count': len(data)
-                    }
-                else:
-                    # For other queries (INSERT, UPDATE, DELETE)
-                    conn.commit()
-                    return {
-                        'affected_rows': cursor.rowcount,
-                        'message': f"Query executed successfully. {cursor.rowcount} rows affected."
+                        'row_count': len(data),
+                        'truncated': truncated
                     }
+                if use_cache:
+                    self.result_cache.put(cache_key, result)
+                return result
+            else:
+                # For other queries (INSERT, UPDATE, DELETE)
+                with self.pool.writer() as conn:
+                    cursor = conn.cursor()
+                    cursor.execute(query)
+                    self._forget_table_stats(conn, tables)
+                self._bump_tables(tables)
+                return {
+                    'affected_rows': cursor.rowcount,
+                    'message': f"Query executed successfully. {cursor.rowcount} rows affected."
+                }
                     
         except Exception as e:
             raise Exception(f"Database query error: {str(e)}")
     
-    def get_table_info(self) -> Dict[str, Dict[str, Any]]:
-        """Get information about all tables in the database"""
+    def _declared_types(self, tables: List[str]) -> Dict[str, str]:
+        """Declared column types of the given tables, keyed by column name"""
+        declared = {}
+        with self.pool.reader() as conn:
+            for table_name in tables:
+                for col in conn.execute(f'PRAGMA table_info("{table_name}")').fetchall():
+                    declared.setdefault(col[1], col[2])
+        return declared
+    
+    def execute_query_df(self, query: str, max_rows: Optional[int] = None, chunk_size: int = 10000,
+                         use_cache: bool = True, guarded: bool = False,
+                         cancel_event: Optional[threading.Event] = None) -> Optional[pd.DataFrame]:
+        """Execute a SELECT and build a DataFrame from typed column buffers, skipping the tuple list
+
+        max_rows defaults to the service's max_result_rows; df.attrs['truncated'] tells
+        whether rows were left behind. With guarded=True (used for all generated SQL) the
+        query runs on the pool's read-only sandbox connection and must be a single read
+        statement, otherwise QueryNotAllowed is raised; the plan is checked by the query
+        guard first, and execution is interrupted on timeout, VM-step budget or when
+        cancel_event is set. Unguarded non-read statements are passed to execute_query.
+        """
+        if guarded:
+            query = self._statement(query)
+        elif not self._is_read_query(query):
+            self.execute_query(query)
+            return None
+        if max_rows is None:
+            max_rows = self.max_result_rows
+        
+        try:
+            tables = ResultCache.referenced_tables(query, self._table_names())
+            self._sync_table_versions()
+            cache_key = self.result_cache.make_key(f"{query} /* max_rows={max_rows} */", tables, kind='dataframe')
+            if use_cache:
+                cached = self.result_cache.get(cache_key)
+                if cached is not None:
+                    return cached['dataframe'].copy(deep=False)
+            
+            connection = self.pool.sandbox() if guarded else self.pool.reader()
+            with connection as conn:
+                if guarded:
+                    self.query_guard.preflight(conn, query)
+                with self.query_guard.limits(conn, cancel_event) if guarded else nullcontext():
+                    cursor = conn.cursor()
+                    cursor.execute(query)
+                    reader = ColumnarReader(cursor, self._declared_types(list(tables)),
+                                            chunk_size=chunk_size, max_rows=max_rows)
+                    df = reader.read_frame()
+                    cursor.close()
+            
+            if use_cache:
+                self.result_cache.put(cache_key, {'dataframe': df})
+            return df.copy(deep=False)
+            
+        except (QueryCancelled, QueryTooExpensive):
+            raise
+        except sqlite3.Error as e:
+            if guarded and self._is_sandbox_violation(e):
+                raise QueryNotAllowed(f"Only a single read-only query can be run on generated SQL: {e}") from e
+            raise Exception(f"Database query error: {str(e)}")
+        except Exception as e:
+            raise Exception(f"Database query error: {str(e)}")
+    
+    @staticmethod
+    def _is_sandbox_violation(error: sqlite3.Error) -> bool:
+        """Whether an error comes from the sandbox refusing a statement rather than from the query itself"""
+        text = str(error).lower()
+        return any(marker in text for marker in ('not authorized', 'one statement at a time', 'readonly database'))
+    
+    def fetch_page(self, query: str, page_size: int = 1000, after: Optional[Any] = None,
+                   key_columns: Optional[List[str]] = None,
+                   cancel_event: Optional[threading.Event] = None) -> Tuple[pd.DataFrame, Optional[Any]]:
+        """Fetch one page of a SELECT's result, returning (page, cursor for the next page or None)
+
+        With key_columns (unique in the result) pages are keyset-paginated on them and
+        the cursor is the last row's key tuple. Without, rows are numbered in the query's
+        own order and the cursor is the last row number, which re-runs the query like
+        OFFSET would; callers holding a capped result should only use it for the rows past
+        the cap. Pages are read on the sandbox connection under the query guard's plan check
+        and limits, like execute_query_df(guarded=True), since the query is usually generated.
+        """
+        query = self._statement(query)
+        if key_columns:
+            keys = ", ".join(f'"{col}"' for col in key_columns)
+            where = f"WHERE ({keys}) > ({', '.join('?' * len(key_columns))})" if after is not None else ""
+            sql = f"SELECT * FROM ({query}) {where} ORDER BY {keys} LIMIT ?"
+            params = (list(after) if after is not None else []) + [page_size + 1]
+        else:
+            sql = f"SELECT * FROM (SELECT ROW_NUMBER() OVER () AS _row, * FROM ({query})) WHERE _row > ? LIMIT ?"
+            params = [after or 0, page_size + 1]
+        
+        try:
+            tables = ResultCache.referenced_tables(query, self._table_names())
+            with self.pool.sandbox() as conn:
+                self.query_guard.preflight(conn, query)
+                with self.query_guard.limits(conn, cancel_event):
+                    cursor = conn.cursor()
+                    cursor.execute(sql, params)
+                    df = ColumnarReader(cursor, self._declared_types(list(tables)),
+                                        chunk_size=page_size + 1).read_frame()
+                    cursor.close()
+        except (QueryCancelled, QueryTooExpensive):
+            raise
+        except sqlite3.Error as e:
+            if self._is_sandbox_violation(e):
+                raise QueryNotAllowed(f"Only a single read-only query can be run on generated SQL: {e}") from e
+            raise Exception(f"Database query error: {str(e)}")
+        except Exception as e:
+            raise Exception(f"Database query error: {str(e)}")
+        
+        has_more = len(df) > page_size
+        df = df.iloc[:page_size]
+        if key_columns:
+            # Plain Python values so the cursor can be bound as parameters (and stored in session state)
+            next_after = tuple(
+                str(v) if isinstance(v, pd.Timestamp) else v.item() if hasattr(v, 'item') else v
+                for v in df.iloc[-1][key_columns]
+            ) if has_more else None
+        else:
+            next_after = int(df['_row'].iloc[-1]) if has_more else None
+            df = df.drop(columns=['_row'])
+        return df.reset_index(drop=True), next_after
+    
+    def iter_query_df(self, query: str, chunk_size: int = 10000, max_rows: Optional[int] = None,
+                      cancel_event: Optional[threading.Event] = None) -> Iterator[pd.DataFrame]:
+        """Execute a SELECT and yield the result as a sequence of DataFrame chunks
+
+        Only one chunk is held in memory at a time, so this streams results of any
+        size (e.g. for export) without the max_result_rows cap. Runs on the read-only
+        sandbox connection under the query guard's plan check and limits.
+        """
+        query = self._statement(query)
+        try:
+            tables = ResultCache.referenced_tables(query, self._table_names())
+            with self.pool.sandbox() as conn:
+                self.query_guard.preflight(conn, query)
+                with self.query_guard.limits(conn, cancel_event):
+                    cursor = conn.cursor()
+                    cursor.execute(query)
+                    reader = ColumnarReader(cursor, self._declared_types(list(tables)),
+                                            chunk_size=chunk_size, max_rows=max_rows)
+                    try:
+                        for chunk in reader.iter_frames():
+                            yield chunk
+                    finally:
+                        cursor.close()
+        except (QueryCancelled, QueryTooExpensive):
+            raise
+        except sqlite3.Error as e:
+            if self._is_sandbox_violation(e):
+                raise QueryNotAllowed(f"Only a single read-only query can be run on generated SQL: {e}") from e
+            raise Exception(f"Database query error: {str(e)}")
+        except Exception as e:
+            raise Exception(f"Database query error: {str(e)}")
+    
+    def _table_bytes(self, conn: sqlite3.Connection, table_name: str) -> Optional[int]:
+        """On-disk size of a table's pages, when SQLite was built with the dbstat table"""
+        try:
+            return conn.execute("SELECT SUM(pgsize) FROM dbstat WHERE name = ?", (table_name,)).fetchone()[0]
+        except sqlite3.OperationalError:
+            return None
+    
+    def get_table_info(self, refresh: bool = False) -> Dict[str, Dict[str, Any]]:
+        """Get information about all tables in the database
+
+        Row counts come from the loader-maintained _table_stats table. Tables without
+        stored stats (or every table with refresh=True) are counted exactly and the
+        result is stored for next time.
+        """
         try:
             tables_info = {}
             
-            with sqlite3.connect(self.db_path) as conn:
+            with self.pool.reader() as conn:
                 cursor = conn.cursor()
                 
                 # Get all table names
-                cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'")
+                cursor.execute(USER_TABLES_SQL)
                 tables = cursor.fetchall()
                 
+                try:
+                    stored = {
+                        row[0]: row[1:] for row in
+                        cursor.execute("SELECT table_name, row_count, byte_size, column_stats, loaded_at "
+                                       "FROM _table_stats").fetchall()
+                    }
+                except sqlite3.OperationalError:
+                    stored = {}
+                
+                recounted = {}
                 for (table_name,) in tables:
                     # Get column information
                     cursor.execute(f"PRAGMA table_info({table_name})")
@@ -80,15 +675,30 @@ class DatabaseService:
                             'primary_key': bool(col[5])
                         })
                     
-                    # Get row count
-                    cursor.execute(f"SELECT COUNT(*) FROM {table_name}")
-                    row_count = cursor.fetchone()[0]
+                    row_count, byte_size, column_stats, loaded_at = stored.get(table_name, (None,) * 4)
+                    if refresh or table_name not in stored:
+                        cursor.execute(f"SELECT COUNT(*) FROM {table_name}")
+                        row_count = cursor.fetchone()[0]
+                        if refresh:
+                            byte_size = self._table_bytes(conn, table_name) or byte_size
+                        recounted[table_name] = (row_count, byte_size, column_stats, loaded_at)
                     
                     tables_info[table_name] = {
                         'columns': columns,
-                        'row_count': row_count
+                        'row_count': row_count,
+                        'byte_size': byte_size,
+                        'column_stats': json.loads(column_stats) if column_stats else {},
+                        'loaded_at': loaded_at
                     }
             
+            if recounted:
+                with self.pool.writer() as conn:
+                    self._ensure_stats_table(conn)
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO _table_stats VALUES (?, ?, ?, ?, ?)",
+                        [(name,) + values for name, values in recounted.items()]
+                    )
+            
             return tables_info
             
         except Exception as e:
@@ -97,27 +707,14 @@ class DatabaseService:
     def get_schema_description(self) -> str:
         """Get a description of the database schema for AI context"""
         try:
-            tables_info = self.get_table_info()
-            schema_desc = "Database Schema:\n\n"
-            
-            for table_name, info in tables_info.items():
-                schema_desc += f"Table: {table_name}\n"
-                schema_desc += f"Rows: {info['row_count']}\n"
-                schema_desc += "Columns:\n"
-                
-                for col in info['columns']:
-                    schema_desc += f"  - {col['name']} ({col['type']})\n"
-                schema_desc += "\n"
-            
-            return schema_desc
-            
+            return "Database Schema:\n\n" + self.schema_catalog.prompt_context(max_tokens=None)
         except Exception as e:
             return f"Error getting schema: {str(e)}"
     
     def test_connection(self) -> bool:
         """Test database connection"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.pool.reader() as conn:
                 cursor = conn.cursor()
                 cursor.execute("SELECT 1")
                 return True
@@ -125,5 +722,5 @@ class DatabaseService:
             return False
     
     def close(self):
-        """Close database connection (not needed for sqlite3 with context manager)"""
-        pass
+        """Close all pooled database connections"""
+        self.pool.close()
@@ -0,0 +1,96 @@
+import io
+import os
+import time
+import pandas as pd
+from typing import Dict, Any, Iterator, Tuple, Union
+
+try:
+    import python_calamine  # noqa: F401  Rust XLSX parser, used by pandas when installed
+    HAS_CALAMINE = True
+except ImportError:
+    HAS_CALAMINE = False
+
+SUPPORTED_EXTENSIONS = ('.xlsx', '.csv', '.parquet')
+
+class FileReader:
+    @staticmethod
+    def file_name(source: Any) -> str:
+        """Best-effort file name of a path or uploaded file object"""
+        return str(getattr(source, 'name', source))
+
+    @staticmethod
+    def source_size(source: Any) -> int:
+        """Size in bytes of a path, raw bytes or uploaded file object (0 when unknown)"""
+        if isinstance(source, (str, os.PathLike)):
+            return os.path.getsize(source)
+        if isinstance(source, bytes):
+            return len(source)
+        size = getattr(source, 'size', None)
+        if isinstance(size, int):
+            return size
+        if hasattr(source, 'getbuffer'):
+            return source.getbuffer().nbytes
+        return 0
+
+    @staticmethod
+    def to_payload(source: Any) -> Union[str, bytes]:
+        """Path or raw bytes for a source, so it can be shipped to a worker process"""
+        if isinstance(source, (str, os.PathLike)):
+            return os.fspath(source)
+        if hasattr(source, 'getvalue'):
+            return source.getvalue()
+        data = source.read()
+        if hasattr(source, 'seek'):
+            source.seek(0)
+        return data
+
+    @staticmethod
+    def iter_xlsx_chunks(source: Any, chunksize: int = 50000) -> Iterator[pd.DataFrame]:
+        """Stream the first worksheet of an XLSX file in row chunks using openpyxl read-only mode"""
+        from openpyxl import load_workbook
+
+        workbook = load_workbook(source, read_only=True, data_only=True)
+        try:
+            rows = workbook.worksheets[0].iter_rows(values_only=True)
+            header = next(rows, None)
+            if header is None:
+                return
+            columns = [str(c) if c is not None else f"column_{i}" for i, c in enumerate(header)]
+            batch = []
+            for row in rows:
+                batch.append(row)
+                if len(batch) >= chunksize:
+                    yield pd.DataFrame.from_records(batch, columns=columns)
+                    batch = []
+            if batch:
+                yield pd.DataFrame.from_records(batch, columns=columns)
+        finally:
+            workbook.close()
+
+    @staticmethod
+    def read_table_file(source: Any, name: str = "") -> pd.DataFrame:
+        """Read an XLSX, CSV or Parquet file into a dataframe, choosing the fastest available reader"""
+        name = (name or FileReader.file_name(source)).lower()
+        if isinstance(source, bytes):
+            source = io.BytesIO(source)
+
+        if name.endswith('.csv'):
+            return pd.read_csv(source)
+        if name.endswith('.parquet'):
+            return pd.read_parquet(source)
+        if HAS_CALAMINE:
+            return pd.read_excel(source, engine='calamine')
+        chunks = list(FileReader.iter_xlsx_chunks(source))
+        return pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
+
+    @staticmethod
+    def parse_and_clean(key: str, name: str, payload: Union[str, bytes]) -> Tuple[str, pd.DataFrame, Dict[str, float]]:
+        """Worker entry point: read and clean one file, returning per-stage timings"""
+        from services.data_cleaner import DataCleaner
+
+        start = time.perf_counter()
+        df = FileReader.read_table_file(payload, name)
+        parsed = time.perf_counter()
+        df = DataCleaner().clean(df)
+        cleaned = time.perf_counter()
+        return key, df, {'parse_seconds': parsed - start, 'clean_seconds': cleaned - parsed}
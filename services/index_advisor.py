@@ -0,0 +1,192 @@
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Any, Optional, Tuple
+from services.query_guard import QueryGuard, QueryCancelled
+
+# Indexes for the access patterns every generated query leans on: per-item joins,
+# date filters and per-item time series. Columns missing from a table are skipped.
+KNOWN_INDEXES = {
+    'ad_sales_metrics': [
+        ['item_id', 'date'],
+        ['date'],
+        ['item_id', 'ad_sales', 'ad_spend', 'clicks', 'impressions'],
+    ],
+    'total_sales_metrics': [
+        ['item_id', 'date'],
+        ['date'],
+        ['item_id', 'total_sales', 'total_units_ordered'],
+    ],
+    'eligibility_table': [
+        ['item_id', 'eligibility_datetime_utc'],
+        ['eligibility'],
+    ],
+}
+
+SQL_KEYWORDS = {
+    'where', 'on', 'join', 'inner', 'left', 'right', 'full', 'cross', 'outer', 'group', 'order',
+    'limit', 'having', 'union', 'as', 'using', 'natural', 'select', 'from'
+}
+
+class IndexAdvisor:
+    def __init__(self, pool, min_occurrences: int = 2, auto_create: bool = True,
+                 query_guard: Optional[QueryGuard] = None, timing_seconds: float = 2.0):
+        """Initialize index advisor over a connection pool
+
+        Sample queries are generated SQL, so before/after timings run on the pool's
+        sandbox connection under query_guard's limits, capped at timing_seconds. Without
+        a query guard only the plans are reported.
+        """
+        self.pool = pool
+        self.min_occurrences = min_occurrences
+        self.auto_create = auto_create
+        self.query_guard = query_guard
+        self.timing_seconds = timing_seconds
+        self.reports: List[Dict[str, Any]] = []
+
+        self._lock = threading.Lock()
+        # (table, columns) -> {'count': n, 'queries': [...]}
+        self._candidates: Dict[Tuple[str, Tuple[str, ...]], Dict[str, Any]] = {}
+
+    @staticmethod
+    def known_indexes(table_name: str, columns: List[str]) -> List[List[str]]:
+        """Known-pattern indexes applicable to a table with the given columns"""
+        available = set(columns)
+        return [cols for cols in KNOWN_INDEXES.get(table_name, []) if set(cols) <= available]
+
+    @staticmethod
+    def _aliases(query: str) -> Dict[str, str]:
+        """Map table aliases (and table names) used in FROM/JOIN clauses to table names"""
+        aliases = {}
+        for table, alias in re.findall(r"\b(?:from|join)\s+\"?(\w+)\"?(?:\s+(?:as\s+)?(\w+))?", query, re.IGNORECASE):
+            aliases[table.lower()] = table
+            if alias and alias.lower() not in SQL_KEYWORDS:
+                aliases[alias.lower()] = table
+        return aliases
+
+    def _table_columns(self, conn: sqlite3.Connection, table_name: str) -> List[str]:
+        """Column names of a table"""
+        return [row[1] for row in conn.execute(f'PRAGMA table_info("{table_name}")').fetchall()]
+
+    @staticmethod
+    def _predicate_columns(query: str, columns: List[str], qualifiers: List[str]) -> List[str]:
+        """Columns of one table compared against constants, equality predicates first
+
+        Join predicates are left out: the planner reports those as automatic indexes.
+        """
+        prefix = rf"(?:(?:{'|'.join(re.escape(q) for q in qualifiers)})\.)?" if qualifiers else ""
+        constant = r"(?:'|-?\d|\?)"
+        equality, ranges = [], []
+        for col in columns:
+            name = rf"(?<![\w.]){prefix}\"?{re.escape(col)}\"?"
+            if re.search(name + rf"\s*(?:==?\s*{constant}|IN\s*\()", query, re.IGNORECASE):
+                equality.append(col)
+            elif re.search(name + rf"\s*(?:(?:<=?|>=?)\s*{constant}|BETWEEN\b|LIKE\b)", query, re.IGNORECASE):
+                ranges.append(col)
+        return equality + ranges
+
+    def explain(self, query: str) -> List[str]:
+        """EXPLAIN QUERY PLAN detail lines for a query"""
+        with self.pool.reader() as conn:
+            return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {query}").fetchall()]
+
+    def analyze_query(self, query: str) -> List[Tuple[str, Tuple[str, ...]]]:
+        """Propose (table, columns) indexes for full scans and automatic indexes in a query plan"""
+        proposals = []
+        aliases = self._aliases(query)
+        with self.pool.reader() as conn:
+            plan = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {query}").fetchall()]
+            for detail in plan:
+                auto = re.match(r"SEARCH (\w+) USING AUTOMATIC (?:COVERING |PARTIAL )*INDEX \((.+)\)", detail)
+                scan = re.match(r"SCAN (\w+)$", detail)
+                if auto:
+                    table = aliases.get(auto.group(1).lower())
+                    cols = tuple(re.findall(r"(\w+)[=<>]", auto.group(2)))
+                    if table and cols:
+                        proposals.append((table, cols))
+                elif scan:
+                    ref = scan.group(1)
+                    table = aliases.get(ref.lower())
+                    if not table:
+                        continue
+                    qualifiers = [a for a, t in aliases.items() if t == table]
+                    cols = self._predicate_columns(query, self._table_columns(conn, table), qualifiers)
+                    if cols:
+                        proposals.append((table, tuple(cols[:3])))
+        return proposals
+
+    def record(self, query: str) -> List[Dict[str, Any]]:
+        """Record a generated query and create indexes for scans seen often enough"""
+        if not query.strip().upper().startswith(('SELECT', 'WITH')):
+            return []
+        try:
+            proposals = self.analyze_query(query)
+        except sqlite3.Error:
+            return []
+
+        ready = []
+        with self._lock:
+            for key in proposals:
+                entry = self._candidates.setdefault(key, {'count': 0, 'queries': []})
+                entry['count'] += 1
+                if len(entry['queries']) < 5:
+                    entry['queries'].append(query)
+                if entry['count'] == self.min_occurrences:
+                    ready.append(key)
+
+        reports = []
+        if self.auto_create:
+            for table, cols in ready:
+                reports.append(self.create_index(table, list(cols), sample_query=query))
+        return reports
+
+    def suggestions(self) -> List[Dict[str, Any]]:
+        """Pending index proposals ordered by how often they were seen"""
+        with self._lock:
+            items = sorted(self._candidates.items(), key=lambda item: -item[1]['count'])
+            return [
+                {'table': table, 'columns': list(cols), 'count': entry['count']}
+                for (table, cols), entry in items
+            ]
+
+    def _time_query(self, query: str) -> Optional[float]:
+        """Wall-clock seconds to run a query to completion, or None if it could not be timed"""
+        if self.query_guard is None:
+            return None
+        start = time.perf_counter()
+        try:
+            with self.pool.sandbox() as conn:
+                with self.query_guard.limits(conn, max_seconds=self.timing_seconds):
+                    conn.execute(query).fetchall()
+        except (QueryCancelled, sqlite3.Error):
+            return None
+        return time.perf_counter() - start
+
+    def create_index(self, table_name: str, columns: List[str],
+                     sample_query: Optional[str] = None) -> Dict[str, Any]:
+        """Create an index and report the plan and timing before and after
+
+        A timing is None when the sample query could not run within the time budget.
+        """
+        index_name = f"ix_{table_name}_{'_'.join(columns)}"
+        column_list = ", ".join(f'"{col}"' for col in columns)
+        report: Dict[str, Any] = {'table': table_name, 'columns': columns, 'index': index_name}
+
+        if sample_query:
+            report['plan_before'] = self.explain(sample_query)
+            report['seconds_before'] = self._time_query(sample_query)
+
+        with self.pool.writer() as conn:
+            conn.execute(f'CREATE INDEX IF NOT EXISTS "{index_name}" ON "{table_name}" ({column_list})')
+            conn.execute(f'ANALYZE "{table_name}"')
+
+        if sample_query:
+            report['plan_after'] = self.explain(sample_query)
+            report['seconds_after'] = self._time_query(sample_query)
+
+        print(f"Index advisor created {index_name}")
+        with self._lock:
+            self._candidates.pop((table_name, tuple(columns)), None)
+            self.reports.append(report)
+        return report
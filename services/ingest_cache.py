@@ -0,0 +1,98 @@
+import hashlib
+import os
+import threading
+import pandas as pd
+from typing import Dict, Any, Optional, Union
+
+try:
+    from pyarrow import feather  # Feather (Arrow IPC) files can be memory-mapped on read
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+# Bump when DataCleaner output changes so stale cleaned frames are not reused
+CLEANER_VERSION = "1"
+
+class IngestCache:
+    def __init__(self, cache_dir: str = ".ingest_cache", max_bytes: int = 1024 * 1024 * 1024):
+        """Initialize on-disk cache of cleaned dataframes keyed by source content hash"""
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.extension = ".feather" if HAS_PYARROW else ".pkl"
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def content_hash(payload: Union[str, bytes], name: str = "") -> str:
+        """SHA-256 of a file's bytes (path or raw bytes) plus its format and the cleaner version"""
+        digest = hashlib.sha256()
+        digest.update(f"{CLEANER_VERSION}:{os.path.splitext(name.lower())[1]}:".encode())
+        if isinstance(payload, bytes):
+            digest.update(payload)
+        else:
+            with open(payload, 'rb') as f:
+                for block in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(block)
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> str:
+        """Cache file path for a key"""
+        return os.path.join(self.cache_dir, key + self.extension)
+
+    def get(self, key: str) -> Optional[pd.DataFrame]:
+        """Load a cached dataframe, memory-mapping it when pyarrow is available"""
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            if HAS_PYARROW:
+                df = feather.read_table(path, memory_map=True).to_pandas()
+            else:
+                df = pd.read_pickle(path)
+            os.utime(path)  # mark as recently used for eviction
+            return df
+        except Exception as e:
+            print(f"Ignoring unreadable ingest cache entry {path}: {str(e)}")
+            return None
+
+    def put(self, key: str, df: pd.DataFrame) -> None:
+        """Store a cleaned dataframe and evict least recently used entries beyond max_bytes"""
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            if HAS_PYARROW:
+                # Uncompressed so the file can be memory-mapped without decoding
+                df.reset_index(drop=True).to_feather(tmp_path, compression='uncompressed')
+            else:
+                df.to_pickle(tmp_path)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            print(f"Could not write ingest cache entry: {str(e)}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        self.evict()
+
+    def evict(self) -> None:
+        """Delete the least recently used entries until the cache fits in max_bytes"""
+        with self._lock:
+            entries = []
+            for name in os.listdir(self.cache_dir):
+                if name.endswith(('.feather', '.pkl')):
+                    path = os.path.join(self.cache_dir, name)
+                    stat = os.stat(path)
+                    entries.append((stat.st_mtime, stat.st_size, path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                os.remove(path)
+                total -= size
+
+    def stats(self) -> Dict[str, Any]:
+        """Number of entries and bytes on disk"""
+        sizes = [
+            os.path.getsize(os.path.join(self.cache_dir, name))
+            for name in os.listdir(self.cache_dir) if name.endswith(('.feather', '.pkl'))
+        ]
+        return {'entries': len(sizes), 'bytes': sum(sizes), 'max_bytes': self.max_bytes}
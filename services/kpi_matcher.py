@@ -0,0 +1,227 @@
+import re
+import threading
+from typing import Dict, Any, Optional, Set, Tuple
+
+# Metric -> (fact table, aggregate over summed columns, phrases). Aggregates work on the
+# fact tables and on the rollup tables alike because rollups keep the same column names.
+METRICS = {
+    'roas': ('ad_sales_metrics', "SUM(ad_sales) / NULLIF(SUM(ad_spend), 0)", ['return on ad spend', 'roas']),
+    'cpc': ('ad_sales_metrics', "SUM(ad_spend) / NULLIF(SUM(clicks), 0)", ['cost per click', 'cpc']),
+    'ctr': ('ad_sales_metrics', "SUM(clicks) * 1.0 / NULLIF(SUM(impressions), 0)",
+            ['click through rate', 'clickthrough rate', 'ctr']),
+    'ad_sales': ('ad_sales_metrics', "SUM(ad_sales)", ['ad sales', 'ad revenue', 'advertising sales']),
+    'ad_spend': ('ad_sales_metrics', "SUM(ad_spend)", ['ad spend', 'advertising spend', 'ad cost', 'spend']),
+    'units_sold': ('ad_sales_metrics', "SUM(units_sold)", ['units sold']),
+    'total_units_ordered': ('total_sales_metrics', "SUM(total_units_ordered)",
+                            ['units ordered', 'total units', 'orders']),
+    'clicks': ('ad_sales_metrics', "SUM(clicks)", ['clicks']),
+    'impressions': ('ad_sales_metrics', "SUM(impressions)", ['impressions']),
+    'total_sales': ('total_sales_metrics', "SUM(total_sales)", ['total sales', 'revenue', 'sales']),
+}
+
+STOPWORDS = {
+    'what', 'is', 'are', 'was', 'were', 'my', 'the', 'a', 'an', 'of', 'for', 'me', 'show', 'give', 'tell',
+    'calculate', 'compute', 'find', 'get', 'list', 'which', 'had', 'has', 'have', 'did', 'does', 'do',
+    'across', 'all', 'overall', 'total', 'our', 'we', 'i', 'in', 'on', 'to', 'from', 'and', 'with', 'please',
+    'value', 'current', 'how', 'much', 'many', 'by', 'per', 'each', 'every', 'their', 'there', 'that', 'it',
+    'products', 'product', 'items', 'item', 'between', 'during', 'date', 'dates', 'day', 'days', 'daily',
+    'top', 'bottom', 'highest', 'lowest', 'best', 'worst', 'most', 'least', 'maximum', 'minimum', 'max',
+    'min', 'largest', 'smallest', 'greatest', 'id', 'who', 'us', 'return', 'eligible', 'eligibility',
+    'advertising', 'ads', 'ad', 'currently', 'status', 'since', 'after', 'until', 'before', 'through'
+}
+
+RANK_DESC = {'top', 'highest', 'best', 'most', 'maximum', 'max', 'largest', 'greatest'}
+RANK_ASC = {'bottom', 'lowest', 'worst', 'least', 'minimum', 'min', 'smallest'}
+DATE_RE = r"(\d{4}-\d{2}-\d{2})"
+NOT_ELIGIBLE_RE = r"\b(?:not eligible|ineligible)\b"
+DAY_WORDS = {'day', 'days', 'daily'}
+RANK_PATTERN = '|'.join(sorted(RANK_DESC | RANK_ASC))
+# A ranked plural subject ("top 3 products", "items with the lowest ctr") ranks items, not days
+PLURAL_RANKED_RE = (rf"\b(?:{RANK_PATTERN})\s+(?:\w+\s+)?(?:products|items)\b"
+                    rf"|\b(?:products|items)\s+(?:with|by|having)\s+(?:the\s+)?(?:{RANK_PATTERN})\b")
+# Questions about how many items meet a condition need COUNT/filters the matcher does not build
+COUNT_RE = r"\bhow many (?:products|items)\b|\b(?:zero|no|none|count|number)\b"
+# Explicit date-range keys: inclusive (start/end) and exclusive (after/before) bounds
+DATE_BOUNDS = {'start_date': '>=', 'after_date': '>', 'end_date': '<=', 'before_date': '<'}
+
+class KPIMatcher:
+    def __init__(self, min_confidence: float = 1.0):
+        """Initialize the local intent matcher for common KPI questions
+
+        By default every word left after removing the metric and parameters must be
+        understood; anything else (negations, counts, unknown grains) goes to the LLM.
+        """
+        self.min_confidence = min_confidence
+        self.hits = 0
+        self.misses = 0
+        self.intent_counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(question: str) -> str:
+        """Lowercase and strip punctuation, keeping ISO dates intact"""
+        text = question.lower().replace('-through', ' through').replace('click-', 'click ')
+        text = re.sub(r"[^a-z0-9\s\-]", " ", text)
+        return " ".join(text.split())
+
+    @staticmethod
+    def _find_metric(text: str) -> Tuple[Optional[str], str]:
+        """First metric whose phrase appears, with that phrase removed from the text"""
+        best = None
+        for metric, (_, _, phrases) in METRICS.items():
+            for phrase in phrases:
+                match = re.search(rf"\b{re.escape(phrase)}\b", text)
+                if match and (best is None or match.start() < best[1]):
+                    best = (metric, match.start())
+        if best is None:
+            return None, text
+        for phrase in METRICS[best[0]][2]:
+            text = re.sub(rf"\b{re.escape(phrase)}\b", " ", text)
+        return best[0], text
+
+    def _parameters(self, text: str) -> Tuple[Dict[str, Any], str]:
+        """Extract top-N, date range and item filters, returning the text with them removed"""
+        params: Dict[str, Any] = {}
+        dates = re.findall(DATE_RE, text)
+        if len(dates) >= 2:
+            params['start_date'], params['end_date'] = sorted(dates[:2])
+        elif len(dates) == 1:
+            if re.search(rf"\bafter\s+{DATE_RE}", text):
+                params['after_date'] = dates[0]
+            elif re.search(rf"\b(?:since|from)\s+{DATE_RE}", text):
+                params['start_date'] = dates[0]
+            elif re.search(rf"\bbefore\s+{DATE_RE}", text):
+                params['before_date'] = dates[0]
+            elif re.search(rf"\b(?:until|through)\s+{DATE_RE}", text):
+                params['end_date'] = dates[0]
+            else:
+                params['start_date'] = params['end_date'] = dates[0]
+        text = re.sub(DATE_RE, " ", text)
+
+        # Only a single item filter is understood; several ids stay in the text as unused numbers
+        items = list(re.finditer(r"\b(?:item|product)s?(?:\s+id)?\s+(\d+)\b", text))
+        if len(items) == 1:
+            params['item_id'] = int(items[0].group(1))
+            text = text[:items[0].start()] + " " + text[items[0].end():]
+
+        top = re.search(rf"\b({RANK_PATTERN})\s+(\d+)\b", text)
+        if top:
+            params['limit'] = int(top.group(2))
+            text = text[:top.start(2)] + " " + text[top.end(2):]
+        return params, text
+
+    def _confidence(self, text: str) -> float:
+        """Share of remaining words the matcher understands
+
+        Numbers left over after parameter extraction ("sales in 2024", "items 5 and 7")
+        were not used in the SQL, so they count as not understood.
+        """
+        words = text.split()
+        if not words:
+            return 1.0
+        return sum(1 for w in words if w in STOPWORDS) / len(words)
+
+    def _eligibility_sql(self, text: str, params: Dict[str, Any]) -> str:
+        """Latest eligibility status per item, filtered to eligible or ineligible items"""
+        wanted = 0 if re.search(NOT_ELIGIBLE_RE, text) else 1
+        item_filter = f" AND e.item_id = {params['item_id']}" if 'item_id' in params else ""
+        return (
+            "SELECT e.item_id, e.eligibility, e.message, e.eligibility_datetime_utc "
+            "FROM eligibility_table e "
+            "WHERE e.eligibility_datetime_utc = ("
+            "SELECT MAX(eligibility_datetime_utc) FROM eligibility_table WHERE item_id = e.item_id) "
+            f"AND e.eligibility = {wanted}{item_filter} ORDER BY e.item_id"
+        )
+
+    def _metric_sql(self, metric: str, text: str, params: Dict[str, Any], tables: Set[str]) -> Optional[str]:
+        """Aggregate SQL for one metric, using rollups when they can answer exactly
+
+        Returns None when the question asks for both a per-item and a per-day breakdown.
+        """
+        fact_table, aggregate, _ = METRICS[metric]
+        words = set(text.split())
+        has_rollups = {'rollup_item_metrics', 'rollup_daily_metrics', 'rollup_global_metrics'} <= tables
+        dated = any(key in params for key in DATE_BOUNDS)
+
+        descending = bool(words & RANK_DESC)
+        ascending = bool(words & RANK_ASC) and not descending
+        ranked = descending or ascending or 'limit' in params
+        item_grain = bool(re.search(r"\b(by|per|each|every)\s+(product|item)s?\b|\bwhich\s+(product|item)", text)
+                          or re.search(PLURAL_RANKED_RE, text))
+        # An explicit grain word decides what is ranked ("which day had the highest sales")
+        by_day = bool(words & DAY_WORDS)
+        if by_day and item_grain:
+            return None
+        by_item = not by_day and (ranked or item_grain)
+
+        conditions = []
+        if (by_day or dated) and not by_item and 'item_id' not in params and has_rollups:
+            source, date_col = 'rollup_daily_metrics', 'day'
+        elif not dated and not by_day and has_rollups:
+            source, date_col = ('rollup_item_metrics' if by_item or 'item_id' in params else 'rollup_global_metrics',
+                                None)
+        else:
+            source, date_col = fact_table, 'date(date)'
+
+        for key, op in DATE_BOUNDS.items():
+            if key in params:
+                conditions.append(f"{date_col} {op} '{params[key]}'")
+        if 'item_id' in params:
+            conditions.append(f"item_id = {params['item_id']}")
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        if by_item:
+            limit = params.get('limit', 1 if re.search(r"\bwhich\s+(product|item)\b", text)
+                                else 10 if descending or ascending else None)
+            order = "ASC" if ascending else "DESC"
+            sql = (f"SELECT item_id, {aggregate} AS {metric} FROM {source}{where} "
+                   f"GROUP BY item_id HAVING {metric} IS NOT NULL ORDER BY {metric} {order}")
+            return sql + (f" LIMIT {limit}" if limit else "")
+        if by_day:
+            day = 'day' if date_col == 'day' else f"{date_col} AS day"
+            sql = f"SELECT {day}, {aggregate} AS {metric} FROM {source}{where} GROUP BY 1"
+            if not ranked:
+                return sql + " ORDER BY 1"
+            limit = params.get('limit', 1 if re.search(r"\bwhich\s+days?\b", text) else 10)
+            order = "ASC" if ascending else "DESC"
+            return sql + f" HAVING {metric} IS NOT NULL ORDER BY {metric} {order} LIMIT {limit}"
+        return f"SELECT {aggregate} AS {metric} FROM {source}{where}"
+
+    def match(self, question: str, tables: Set[str]) -> Optional[Dict[str, Any]]:
+        """Return {'sql', 'intent', 'params', 'confidence'} for a recognized KPI question, else None"""
+        text = self._normalize(question)
+        params, text = self._parameters(text)
+        result = None
+
+        if re.search(COUNT_RE, text):
+            pass
+        elif re.search(r"\b(eligible|ineligible|eligibility)\b", text) and 'eligibility_table' in tables:
+            remaining = re.sub(r"\b(for|to)\s+advertis\w*\b", " ", re.sub(NOT_ELIGIBLE_RE, " ", text))
+            result = {'sql': self._eligibility_sql(text, params), 'intent': 'eligibility',
+                      'confidence': self._confidence(remaining)}
+        else:
+            metric, remaining = self._find_metric(text)
+            sql = self._metric_sql(metric, remaining, params, tables) \
+                if metric and METRICS[metric][0] in tables else None
+            if sql:
+                result = {'sql': sql, 'intent': metric, 'confidence': self._confidence(remaining)}
+
+        with self._lock:
+            if result is None or result['confidence'] < self.min_confidence:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.intent_counts[result['intent']] = self.intent_counts.get(result['intent'], 0) + 1
+        result['params'] = params
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and hit rate"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'intents': dict(self.intent_counts)
+            }
@@ -0,0 +1,424 @@
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from typing import Dict, List, Any, Optional, Iterator, Callable, Tuple
+
+try:
+    import google.generativeai as genai
+    HAS_GENAI = True
+except ImportError:
+    HAS_GENAI = False
+
+class LLMUnavailable(Exception):
+    """Raised when the provider is failing and the call was given up or refused by the circuit breaker"""
+
+class LLMBackend:
+    """Text-in, text-out model interface used by AIService"""
+    name = "base"
+    _shared: Dict[Tuple[str, str], 'LLMBackend'] = {}
+    _shared_lock = threading.Lock()
+
+    @classmethod
+    def shared(cls, key: str, factory: Callable[[], 'LLMBackend'], **kwargs) -> 'LLMBackend':
+        """Return the wrapper of this class shared by every AIService using the same backend, creating it once"""
+        with LLMBackend._shared_lock:
+            if (cls.__name__, key) not in LLMBackend._shared:
+                LLMBackend._shared[(cls.__name__, key)] = cls(factory(), **kwargs)
+            return LLMBackend._shared[(cls.__name__, key)]
+
+    def generate(self, prompt: str) -> str:
+        """Return the full completion for a prompt"""
+        raise NotImplementedError
+
+    def stream(self, prompt: str) -> Iterator[str]:
+        """Yield the completion in chunks; backends without streaming yield it whole"""
+        yield self.generate(prompt)
+
+class GeminiBackend(LLMBackend):
+    def __init__(self, api_key: Optional[str] = None, model_name: str = "gemini-1.5-flash",
+                 model: Optional[Any] = None, timeout: Optional[float] = 30.0):
+        """Gemini via google.generativeai, or any object exposing generate_content(prompt, stream=...)
+
+        timeout bounds each HTTP request so a hung connection cannot hold a worker forever.
+        """
+        self.request_options: Dict[str, Any] = {}
+        if model is not None:
+            self.model = model
+            self.name = getattr(model, 'model_name', type(model).__name__)
+            return
+        if not HAS_GENAI:
+            raise ValueError("google-generativeai is not installed")
+        api_key = api_key or os.getenv("GEMINI_API_KEY")
+        if not api_key:
+            raise ValueError("GEMINI_API_KEY environment variable is required")
+        genai.configure(api_key=api_key)
+        self.model = genai.GenerativeModel(model_name=model_name)
+        self.name = model_name
+        if timeout is not None:
+            self.request_options = {'request_options': {'timeout': timeout}}
+
+    def generate(self, prompt: str) -> str:
+        """Single non-streaming call"""
+        response = self.model.generate_content(prompt, **self.request_options)
+        return response.text or ""
+
+    def stream(self, prompt: str) -> Iterator[str]:
+        """Streaming call, yielding text chunks as they arrive"""
+        for chunk in self.model.generate_content(prompt, stream=True, **self.request_options):
+            text = getattr(chunk, 'text', '')
+            if text:
+                yield text
+
+class LocalBackend(LLMBackend):
+    name = "local"
+
+    def __init__(self, latency: float = 0.0):
+        """Deterministic offline stand-in that answers the app's prompt templates with rules
+
+        SQL prompts are answered by the KPI matcher fast path (questions it does not
+        recognize raise LLMUnavailable), insights prompts by restating the result summary,
+        and chart prompts by keyword. latency simulates provider response time for load tests.
+        """
+        from services.kpi_matcher import KPIMatcher
+        self.latency = latency
+        self.matcher = KPIMatcher()
+
+    @staticmethod
+    def _section(prompt: str, start: str, end: str) -> str:
+        """Text between two markers of a prompt template"""
+        match = re.search(rf"{re.escape(start)}(.*?)(?:{re.escape(end)}|$)", prompt, re.DOTALL)
+        return match.group(1).strip() if match else ""
+
+    def _sql(self, prompt: str) -> str:
+        """SQL for a SQL-generation prompt"""
+        question = self._section(prompt, "Question:", "\n")
+        tables = re.findall(r"^\s*(\w+)(?: \(\d+ rows\))?:", prompt, re.MULTILINE)
+        tables = [t for t in tables if t.lower() not in ('notes', 'question', 'database')]
+        match = self.matcher.match(question, set(tables))
+        if match is None:
+            raise LLMUnavailable(
+                "The language model is unavailable and this is not a recognized KPI question. "
+                "Try again later, or ask for a standard metric such as total sales or RoAS."
+            )
+        return match['sql']
+
+    def _insights(self, prompt: str) -> str:
+        """Bullet-point restatement of the result summary in an insights prompt"""
+        summary = self._section(prompt, "Query Results:", "Provide:")
+        lines = [line.strip() for line in summary.splitlines() if line.strip()][:8]
+        body = "\n".join(f"- {line}" for line in lines) or "- The query returned no rows."
+        return (
+            "**Key insights** (offline summary, no LLM available)\n"
+            f"{body}\n\n"
+            "**Recommendations**\n- Review the top items and the latest period change above."
+        )
+
+    def generate(self, prompt: str) -> str:
+        """Answer one of the app's prompt templates"""
+        if self.latency:
+            time.sleep(self.latency)
+        if "SQL Query:" in prompt:
+            return self._sql(prompt)
+        if "suggest a visualization type" in prompt:
+            question = self._section(prompt, "Question:", "\n").lower()
+            if any(k in question for k in ('trend', 'daily', 'over time')):
+                return "line"
+            if any(k in question for k in ('share', 'breakdown', 'proportion')):
+                return "pie"
+            return "bar"
+        if "business analyst" in prompt:
+            return self._insights(prompt)
+        if "API Working" in prompt:
+            return "API Working"
+        return ""
+
+def call_with_timeout(func: Callable[..., Any], timeout: float, *args) -> Any:
+    """Run func in a daemon thread and wait at most timeout seconds for it
+
+    A call that outlives the timeout is abandoned (it cannot be killed) and
+    TimeoutError is raised, so a hung provider request never blocks the caller.
+    """
+    future: Future = Future()
+
+    def run() -> None:
+        try:
+            future.set_result(func(*args))
+        except Exception as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, daemon=True, name="llm-call").start()
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeout:
+        raise TimeoutError(f"no answer within {timeout:.1f}s") from None
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """Whether a provider error means we are being throttled"""
+    text = f"{type(error).__name__} {error}".lower()
+    return any(marker in text for marker in ('resourceexhausted', '429', 'rate limit', 'quota'))
+
+def is_transient_error(error: Exception) -> bool:
+    """Whether a provider error is worth retrying (throttling, server errors, timeouts, dropped connections)"""
+    if isinstance(error, (TimeoutError, ConnectionError)) or is_rate_limit_error(error):
+        return True
+    text = f"{type(error).__name__} {error}".lower()
+    return any(marker in text for marker in (
+        'serviceunavailable', 'internalservererror', 'deadlineexceeded', 'timeout', 'timed out',
+        '500', '502', '503', '504', 'unavailable', 'connection'
+    ))
+
+class BatchingBackend(LLMBackend):
+    def __init__(self, backend: LLMBackend, max_concurrency: int = 8, requests_per_minute: Optional[int] = 60):
+        """Share one backend across sessions with bounded, rate-limited concurrency
+
+        Identical prompts already in flight are coalesced into a single call (every
+        caller gets its result). Calls are admitted by a requests-per-minute window
+        and a concurrency limit that halves when the provider reports throttling and
+        grows back by one after each success.
+        """
+        self.backend = backend
+        self.name = backend.name
+        self.max_concurrency = max_concurrency
+        self.requests_per_minute = requests_per_minute
+        self.limit = max_concurrency
+        self.active = 0
+        self.calls = 0
+        self.coalesced = 0
+        self.throttled = 0
+
+        self._cond = threading.Condition()
+        self._inflight: Dict[str, Future] = {}
+        self._sent: deque = deque()
+
+    def _acquire(self) -> None:
+        """Wait for a concurrency slot and room in the per-minute window"""
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                while self._sent and now - self._sent[0] >= 60:
+                    self._sent.popleft()
+                window_full = self.requests_per_minute is not None and len(self._sent) >= self.requests_per_minute
+                if self.active < self.limit and not window_full:
+                    self.active += 1
+                    self._sent.append(now)
+                    return
+                timeout = 60 - (now - self._sent[0]) if window_full else None
+                self._cond.wait(timeout=timeout)
+
+    def _release(self, error: Optional[Exception] = None) -> None:
+        """Free a slot and adapt the concurrency limit to throttling"""
+        with self._cond:
+            self.active -= 1
+            self.calls += 1
+            if error is not None and is_rate_limit_error(error):
+                self.throttled += 1
+                self.limit = max(1, self.limit // 2)
+            elif error is None and self.limit < self.max_concurrency:
+                self.limit += 1
+            self._cond.notify_all()
+
+    def generate(self, prompt: str) -> str:
+        """Run (or join an identical in-flight) call"""
+        with self._cond:
+            future = self._inflight.get(prompt)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._inflight[prompt] = future
+            else:
+                self.coalesced += 1
+        if not owner:
+            return future.result()
+
+        error = None
+        try:
+            self._acquire()
+            try:
+                future.set_result(self.backend.generate(prompt))
+            except Exception as e:
+                error = e
+                future.set_exception(e)
+            finally:
+                self._release(error)
+        finally:
+            with self._cond:
+                self._inflight.pop(prompt, None)
+        return future.result()
+
+    def stream(self, prompt: str) -> Iterator[str]:
+        """Streaming call holding one slot for its whole duration"""
+        self._acquire()
+        error = None
+        try:
+            yield from self.backend.stream(prompt)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self._release(error)
+
+    def generate_many(self, prompts: List[str]) -> List[Any]:
+        """Run several prompts concurrently under the shared limits; failures are returned as exceptions"""
+        results: List[Any] = [None] * len(prompts)
+
+        def run(i: int, prompt: str) -> None:
+            try:
+                results[i] = self.generate(prompt)
+            except Exception as e:
+                results[i] = e
+
+        threads = [threading.Thread(target=run, args=(i, p), daemon=True) for i, p in enumerate(prompts)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def stats(self) -> Dict[str, Any]:
+        """Call, coalescing and throttling counters"""
+        with self._cond:
+            return {
+                'backend': self.name,
+                'calls': self.calls,
+                'coalesced': self.coalesced,
+                'throttled': self.throttled,
+                'concurrency_limit': self.limit,
+                'active': self.active
+            }
+
+class ResilientBackend(LLMBackend):
+    def __init__(self, backend: LLMBackend, max_retries: int = 3, base_delay: float = 0.5, max_delay: float = 8.0,
+                 deadline: float = 45.0, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        """Retry transient provider errors with jittered backoff behind a circuit breaker
+
+        Each call gets deadline seconds for all attempts and backoff sleeps together;
+        attempts run in a daemon thread so a hung request cannot exceed it. After
+        failure_threshold consecutive calls fail transiently (once their retries are
+        used up; single retried attempts do not count) the breaker opens and calls
+        raise LLMUnavailable immediately for reset_timeout seconds, after which a
+        single probe call decides whether to close it again.
+        """
+        self.backend = backend
+        self.name = backend.name
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+        self.counters = {'calls': 0, 'retries': 0, 'timeouts': 0, 'failures': 0, 'trips': 0, 'fast_fails': 0}
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self.counters[name] += 1
+
+    def _admit(self) -> None:
+        """Raise LLMUnavailable while the breaker is open; let one probe through once it cools down"""
+        with self._lock:
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = 'half_open'
+            if self.state == 'open' or (self.state == 'half_open' and self._probing):
+                self.counters['fast_fails'] += 1
+                raise LLMUnavailable(f"{self.name} is unavailable (circuit open after repeated failures)")
+            if self.state == 'half_open':
+                self._probing = True
+            self.counters['calls'] += 1
+
+    def _record(self, error: Optional[Exception]) -> None:
+        """Update the breaker with the final outcome of one call"""
+        with self._lock:
+            self._probing = False
+            if error is None:
+                self.state, self.failures = 'closed', 0
+                return
+            if not is_transient_error(error):
+                return
+            self.failures += 1
+            if self.state == 'half_open' or (self.state == 'closed' and self.failures >= self.failure_threshold):
+                self.state, self.opened_at = 'open', time.monotonic()
+                self.counters['trips'] += 1
+
+    def _backoff(self, attempt: int) -> float:
+        """Full-jitter exponential backoff so retrying sessions spread out instead of stampeding"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def _attempt(self, prompt: str, timeout: float) -> str:
+        """One call, abandoned (not killed) if it outlives the remaining deadline"""
+        try:
+            return call_with_timeout(self.backend.generate, timeout, prompt)
+        except TimeoutError:
+            self._count('timeouts')
+            raise TimeoutError(f"{self.name} did not answer within {timeout:.1f}s") from None
+
+    def generate(self, prompt: str) -> str:
+        """Call the backend, retrying transient errors until the deadline"""
+        self._admit()
+        deadline = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            try:
+                result = self._attempt(prompt, max(deadline - time.monotonic(), 0.001))
+            except Exception as e:
+                if not is_transient_error(e):
+                    self._record(e)
+                    raise
+                delay = self._backoff(attempt)
+                attempt += 1
+                if attempt > self.max_retries or time.monotonic() + delay >= deadline or self.state == 'open':
+                    self._record(e)
+                    self._count('failures')
+                    raise LLMUnavailable(f"{self.name} failed after {attempt} attempt(s): {e}") from e
+                self._count('retries')
+                time.sleep(delay)
+                continue
+            self._record(None)
+            return result
+
+    def stream(self, prompt: str) -> Iterator[str]:
+        """Stream from the backend; retries only happen before the first chunk has been yielded"""
+        self._admit()
+        deadline = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            started = False
+            try:
+                for text in self.backend.stream(prompt):
+                    started = True
+                    yield text
+            except GeneratorExit:
+                # The consumer stopped reading; what it got so far came through fine
+                self._record(None)
+                raise
+            except Exception as e:
+                if started or not is_transient_error(e):
+                    self._record(e)
+                    raise
+                delay = self._backoff(attempt)
+                attempt += 1
+                if attempt > self.max_retries or time.monotonic() + delay >= deadline or self.state == 'open':
+                    self._record(e)
+                    self._count('failures')
+                    raise LLMUnavailable(f"{self.name} failed after {attempt} attempt(s): {e}") from e
+                self._count('retries')
+                time.sleep(delay)
+                continue
+            self._record(None)
+            return
+
+    def stats(self) -> Dict[str, Any]:
+        """Breaker state and retry/trip counters, plus the wrapped backend's stats if it has any"""
+        with self._lock:
+            stats = {'backend': self.name, 'circuit': self.state, **self.counters}
+        if hasattr(self.backend, 'stats'):
+            stats['inner'] = self.backend.stats()
+        return stats
@@ -0,0 +1,125 @@
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Any, Optional, Callable
+
+class QueryCancelled(Exception):
+    """Raised when a guarded query is cancelled by the user"""
+
+class QueryTimeout(QueryCancelled):
+    """Raised when a guarded query exceeds its time or VM-step budget"""
+
+class QueryTooExpensive(Exception):
+    """Raised when a query plan is rejected before execution"""
+
+class QueryNotAllowed(Exception):
+    """Raised when SQL run on the read-only path is not a single read statement"""
+
+class QueryGuard:
+    def __init__(self, row_counts: Optional[Callable[[], Dict[str, int]]] = None, max_seconds: float = 30.0,
+                 max_vm_steps: Optional[int] = 500_000_000, check_interval: int = 10000,
+                 max_nested_rows: int = 10_000_000):
+        """Initialize limits for running generated SQL
+
+        row_counts returns current table sizes (e.g. from the loader metadata) and is used
+        to estimate how many row combinations a nested full scan would visit.
+        """
+        self.row_counts = row_counts
+        self.max_seconds = max_seconds
+        self.max_vm_steps = max_vm_steps
+        self.check_interval = check_interval
+        self.max_nested_rows = max_nested_rows
+        self.rejected = 0
+        self.interrupted = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _plan(conn: sqlite3.Connection, query: str) -> List[tuple]:
+        """(id, parent, detail) rows of EXPLAIN QUERY PLAN"""
+        return [(row[0], row[1], row[3]) for row in conn.execute(f"EXPLAIN QUERY PLAN {query}").fetchall()]
+
+    def preflight(self, conn: sqlite3.Connection, query: str) -> Dict[str, Any]:
+        """Reject plans that nest full table scans over large tables
+
+        SQLite already builds automatic indexes for unindexed equality joins, so a
+        second SCAN in the same loop nest means a cross product or a non-equality
+        join; its cost is estimated as the product of the scanned tables' row counts.
+        """
+        plan = self._plan(conn, query)
+        counts = {name.lower(): n for name, n in (self.row_counts() if self.row_counts else {}).items()}
+        aliases = {
+            (alias or table).lower(): table.lower()
+            for table, alias in re.findall(
+                r"(?:\bfrom|\bjoin|,)\s+\"?(\w+)\"?(?:\s+(?:as\s+)?(\w+))?", query, re.IGNORECASE
+            )
+        }
+
+        # Full scans grouped by loop nest (rows sharing a parent are nested loops of one join)
+        scans: Dict[int, List[str]] = {}
+        for _, parent, detail in plan:
+            # A full scan of a covering index still visits every row
+            match = re.match(r"SCAN (\w+)(?: AS \w+)?(?: USING (?:COVERING )?INDEX \w+)?$", detail)
+            if match:
+                scans.setdefault(parent, []).append(match.group(1).lower())
+
+        worst = {'tables': [], 'estimated_rows': 0}
+        for tables in scans.values():
+            if len(tables) < 2:
+                continue
+            # Unresolved references are assumed to be as large as the largest table
+            largest = max(counts.values(), default=1)
+            estimate = 1
+            for ref in tables:
+                estimate *= max(counts.get(aliases.get(ref, ref), largest), 1)
+            if estimate > worst['estimated_rows']:
+                worst = {'tables': tables, 'estimated_rows': estimate}
+
+        if worst['estimated_rows'] > self.max_nested_rows:
+            with self._lock:
+                self.rejected += 1
+            raise QueryTooExpensive(
+                f"Query rejected: nested full scans of {', '.join(worst['tables'])} would visit about "
+                f"{worst['estimated_rows']:,} row combinations. Add a join condition or filter."
+            )
+        return {'plan': [detail for _, _, detail in plan], **worst}
+
+    @contextmanager
+    def limits(self, conn: sqlite3.Connection, cancel_event: Optional[threading.Event] = None,
+               max_seconds: Optional[float] = None):
+        """Interrupt statements on this connection on cancellation, timeout or VM-step budget"""
+        start = time.monotonic()
+        deadline = start + (max_seconds if max_seconds is not None else self.max_seconds)
+        state = {'steps': 0, 'reason': None}
+
+        def handler() -> int:
+            state['steps'] += self.check_interval
+            if cancel_event is not None and cancel_event.is_set():
+                state['reason'] = 'cancelled'
+            elif time.monotonic() > deadline:
+                state['reason'] = 'timeout'
+            elif self.max_vm_steps is not None and state['steps'] > self.max_vm_steps:
+                state['reason'] = 'steps'
+            return 1 if state['reason'] else 0
+
+        conn.set_progress_handler(handler, self.check_interval)
+        try:
+            yield
+        except sqlite3.OperationalError as e:
+            if state['reason'] is None:
+                raise
+            with self._lock:
+                self.interrupted += 1
+            if state['reason'] == 'cancelled':
+                raise QueryCancelled("Query cancelled") from e
+            if state['reason'] == 'timeout':
+                raise QueryTimeout(f"Query timed out after {time.monotonic() - start:.1f}s") from e
+            raise QueryTimeout(f"Query exceeded its budget of {self.max_vm_steps:,} VM steps") from e
+        finally:
+            conn.set_progress_handler(None, 0)
+
+    def stats(self) -> Dict[str, int]:
+        """Counts of rejected and interrupted queries"""
+        with self._lock:
+            return {'rejected': self.rejected, 'interrupted': self.interrupted}
@@ -0,0 +1,133 @@
+import time
+import queue
+import threading
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Dict, Any, Optional, Iterator, Tuple
+from services.ai_service import AIService
+from services.database_service import DatabaseService
+from services.visualization_service import VisualizationService
+from services.kpi_matcher import KPIMatcher
+
+class QueryPipeline:
+    def __init__(self, ai_service: AIService, db_service: DatabaseService, viz_service: VisualizationService,
+                 max_workers: int = 4, insights_timeout: float = 60.0, chart_timeout: float = 20.0,
+                 suggestion_timeout: float = 5.0):
+        """Initialize the question-answering pipeline"""
+        self.ai_service = ai_service
+        self.db_service = db_service
+        self.viz_service = viz_service
+        self.insights_timeout = insights_timeout
+        self.chart_timeout = chart_timeout
+        self.suggestion_timeout = suggestion_timeout
+        self.kpi_matcher = KPIMatcher()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="query-pipeline")
+
+    def run_query(self, question: str,
+                  cancel_event: Optional[threading.Event] = None) -> Tuple[str, Optional[pd.DataFrame]]:
+        """Generate SQL for a question (locally for common KPIs, otherwise via the LLM) and execute it"""
+        match = self.kpi_matcher.match(question, set(self.db_service._table_names()))
+        if match:
+            sql_query = match['sql']
+            print(f"KPI fast path: {match['intent']} (confidence {match['confidence']:.2f})")
+        else:
+            sql_query = self.ai_service.generate_sql_query(
+                question,
+                schema_context=self.db_service.schema_catalog.prompt_context(),
+                schema_fingerprint=self.db_service.get_schema_fingerprint(),
+                validate=self.db_service.validate_sql
+            )
+        df = self.db_service.execute_query_df(sql_query, guarded=True, cancel_event=cancel_event)
+        # Feed the advisor after execution so index creation never delays this answer's plan
+        self.executor.submit(self.db_service.index_advisor.record, sql_query)
+        return sql_query, df
+
+    def submit_query(self, question: str, cancel_event: Optional[threading.Event] = None) -> Future:
+        """Run run_query on a worker thread, so the caller can keep polling (and be interrupted) meanwhile"""
+        return self.executor.submit(self.run_query, question, cancel_event)
+
+    def _build_chart(self, question: str, data: pd.DataFrame, suggestion: Optional[Future]):
+        """Build the chart, using the LLM chart type if it arrives within its budget"""
+        viz_type = None
+        if suggestion is not None:
+            try:
+                viz_type = suggestion.result(timeout=self.suggestion_timeout)
+            except Exception:
+                viz_type = None
+        return self.viz_service.create_visualization(question, data, viz_type=viz_type)
+
+    def _run_stage(self, events: queue.Queue, stage: str, func, *args) -> None:
+        """Run one stage in a worker thread and post its result (or exception) to the event queue"""
+        try:
+            events.put((stage, func(*args)))
+        except Exception as e:
+            events.put((stage, e))
+
+    def _stream_insights(self, events: queue.Queue, question: str, data: pd.DataFrame) -> str:
+        """Forward streamed insight chunks to the event queue and return the full text"""
+        parts = []
+        for chunk in self.ai_service.stream_business_insights(question, data):
+            parts.append(chunk)
+            events.put(('insights_chunk', chunk))
+        return "".join(parts)
+
+    def analyze_iter(self, question: str, data: pd.DataFrame, suggest_chart: bool = False,
+                     stream_insights: bool = False) -> Iterator[Tuple[str, Any]]:
+        """Run post-query stages concurrently, yielding (stage, result) as each finishes
+
+        Stages are 'insights' and 'chart'. With stream_insights, 'insights_chunk' events
+        carry partial text before the final 'insights'. A stage that fails or exceeds
+        its timeout yields an Exception instead of a result so the caller can render
+        what it has.
+        """
+        start = time.monotonic()
+        events: queue.Queue = queue.Queue()
+        suggestion = None
+        if suggest_chart:
+            suggestion = self.executor.submit(self.ai_service.suggest_visualization_type, question, data)
+
+        if stream_insights:
+            self.executor.submit(self._run_stage, events, 'insights', self._stream_insights, events, question, data)
+        else:
+            self.executor.submit(self._run_stage, events, 'insights',
+                                 self.ai_service.generate_business_insights, question, data)
+        self.executor.submit(self._run_stage, events, 'chart', self._build_chart, question, data, suggestion)
+
+        deadlines = {
+            'insights': start + self.insights_timeout,
+            'chart': start + self.chart_timeout
+        }
+        while deadlines:
+            try:
+                stage, value = events.get(timeout=max(min(deadlines.values()) - time.monotonic(), 0))
+            except queue.Empty:
+                now = time.monotonic()
+                for stage in [s for s, deadline in deadlines.items() if deadline <= now]:
+                    del deadlines[stage]
+                    yield stage, TimeoutError(f"{stage} timed out after {now - start:.1f}s")
+                continue
+
+            if stage == 'insights_chunk':
+                if 'insights' in deadlines:
+                    yield stage, value
+            elif stage in deadlines:
+                del deadlines[stage]
+                yield stage, value
+
+    def analyze(self, question: str, data: pd.DataFrame, suggest_chart: bool = False) -> Dict[str, Any]:
+        """Run post-query stages concurrently and collect whatever finished"""
+        start = time.monotonic()
+        results: Dict[str, Any] = {'insights': None, 'chart': None, 'errors': {}, 'timings': {}}
+        for stage, value in self.analyze_iter(question, data, suggest_chart=suggest_chart):
+            if stage == 'insights_chunk':
+                continue
+            results['timings'][stage] = time.monotonic() - start
+            if isinstance(value, Exception):
+                results['errors'][stage] = str(value)
+            else:
+                results[stage] = value
+        return results
+
+    def close(self) -> None:
+        """Shut down worker threads without waiting for abandoned stages"""
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,139 @@
+import re
+import sys
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple, Iterable, List
+
+class ResultCache:
+    _instances: Dict[str, 'ResultCache'] = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        """Initialize a byte-size-capped LRU cache of query results"""
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._entries: 'OrderedDict[Tuple, Tuple[Dict[str, Any], int]]' = OrderedDict()
+        self._table_versions: Dict[str, int] = {}
+        # Last seen persisted (database file) version per table, see sync_versions
+        self._persisted_versions: Dict[str, int] = {}
+
+    @classmethod
+    def for_database(cls, db_path: str, max_bytes: int = 64 * 1024 * 1024) -> 'ResultCache':
+        """Return the cache shared by every DatabaseService on the same file"""
+        with cls._instances_lock:
+            if db_path not in cls._instances:
+                cls._instances[db_path] = cls(max_bytes=max_bytes)
+            return cls._instances[db_path]
+
+    @staticmethod
+    def canonicalize(query: str) -> str:
+        """Collapse whitespace and case outside string literals so equivalent SQL shares a key"""
+        parts = re.split(r"('(?:[^']|'')*')", query.strip().rstrip(';'))
+        for i in range(0, len(parts), 2):
+            parts[i] = " ".join(parts[i].split()).lower()
+        return "".join(parts).strip()
+
+    @staticmethod
+    def referenced_tables(query: str, table_names: Iterable[str]) -> Tuple[str, ...]:
+        """Known table names that appear as identifiers in the query"""
+        lowered = query.lower()
+        return tuple(sorted(
+            name for name in table_names
+            if re.search(rf"\b{re.escape(name.lower())}\b", lowered)
+        ))
+
+    @staticmethod
+    def _estimate_size(result: Dict[str, Any]) -> int:
+        """Approximate memory footprint of a result by sampling rows"""
+        if 'dataframe' in result:
+            return sys.getsizeof(result) + int(result['dataframe'].memory_usage(index=True, deep=True).sum())
+        data = result.get('data') or []
+        if not data:
+            return sys.getsizeof(result)
+        sample = data[:100]
+        sample_bytes = sum(sys.getsizeof(row) + sum(sys.getsizeof(v) for v in row) for row in sample)
+        return sys.getsizeof(result) + int(sample_bytes * len(data) / len(sample))
+
+    def table_version(self, table_name: str) -> int:
+        """Current data version of a table"""
+        with self._lock:
+            return self._table_versions.get(table_name.lower(), 0)
+
+    def bump_table(self, table_name: str, persisted_version: Optional[int] = None) -> None:
+        """Mark a table's data as changed so cached results over it are never served"""
+        table_name = table_name.lower()
+        with self._lock:
+            if persisted_version is not None:
+                self._persisted_versions[table_name] = persisted_version
+            self._table_versions[table_name] = self._table_versions.get(table_name, 0) + 1
+            stale = [key for key in self._entries if table_name in key[1]]
+            for key in stale:
+                self.current_bytes -= self._entries.pop(key)[1]
+
+    def sync_versions(self, persisted: Dict[str, int]) -> List[str]:
+        """Bump every table whose persisted version differs from the last one seen
+
+        Persisted versions are stored in the database, so this catches loads made by
+        other processes on the same file. Returns the tables that changed.
+        """
+        with self._lock:
+            changed = [(name.lower(), version) for name, version in persisted.items()
+                       if self._persisted_versions.get(name.lower()) != version]
+        for name, version in changed:
+            self.bump_table(name, persisted_version=version)
+        return [name for name, _ in changed]
+
+    def make_key(self, query: str, tables: Tuple[str, ...], kind: str = 'rows') -> Tuple:
+        """Cache key from canonical SQL and the versions of the tables it reads"""
+        tables = tuple(t.lower() for t in tables)
+        with self._lock:
+            versions = tuple(self._table_versions.get(t, 0) for t in tables)
+        return (self.canonicalize(query), tables, versions, kind)
+
+    def get(self, key: Tuple) -> Optional[Dict[str, Any]]:
+        """Return a cached result and mark it most recently used"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return dict(entry[0])
+
+    def put(self, key: Tuple, result: Dict[str, Any]) -> None:
+        """Store a result, evicting least recently used entries beyond max_bytes"""
+        size = self._estimate_size(result)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            # Drop results computed against a version that has since been bumped
+            if key[2] != tuple(self._table_versions.get(t, 0) for t in key[1]):
+                return
+            if key in self._entries:
+                self.current_bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (result, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes and self._entries:
+                self.current_bytes -= self._entries.popitem(last=False)[1][1]
+
+    def clear(self) -> None:
+        """Remove every cached result"""
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters and memory usage"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._entries),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes
+            }
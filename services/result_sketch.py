@@ -0,0 +1,193 @@
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Any, Optional, Iterable
+from services.schema_catalog import CHARS_PER_TOKEN
+
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+class ResultSketch:
+    def __init__(self, top_k: int = 5, sample_size: int = 10000, max_metrics: int = 8, seed: int = 0):
+        """Initialize a fixed-size statistical sketch of a query result
+
+        Feed it one DataFrame or a stream of chunks with update(). Memory stays bounded:
+        quantiles come from a uniform sample of at most sample_size rows, top items are
+        merged per chunk, and period totals hold one row per period.
+        """
+        self.top_k = top_k
+        self.sample_size = sample_size
+        self.max_metrics = max_metrics
+        self._rng = np.random.default_rng(seed)
+
+        self.columns: List[str] = []
+        self.metrics: List[str] = []
+        self.label: Optional[str] = None
+        self.date: Optional[str] = None
+        self.rows = 0
+        self.nulls: Dict[str, int] = {}
+        self._sum = self._min = self._max = self._count = None
+        self._sample_keys = np.empty(0)
+        self._sample = np.empty((0, 0))
+        self._top: Dict[str, pd.DataFrame] = {}
+        self._periods: Optional[pd.DataFrame] = None
+
+    @classmethod
+    def from_frame(cls, data: pd.DataFrame, **kwargs) -> 'ResultSketch':
+        """Sketch an in-memory result"""
+        return cls(**kwargs).update(data)
+
+    @classmethod
+    def from_chunks(cls, chunks: Iterable[pd.DataFrame], **kwargs) -> 'ResultSketch':
+        """Sketch a streamed result, e.g. DatabaseService.iter_query_df"""
+        sketch = cls(**kwargs)
+        for chunk in chunks:
+            sketch.update(chunk)
+        return sketch
+
+    def _init_roles(self, chunk: pd.DataFrame) -> None:
+        """Pick metric, label and date columns from the first chunk"""
+        self.columns = [str(c) for c in chunk.columns]
+        id_like = [c for c in chunk.columns if str(c).lower() == 'id' or str(c).lower().endswith('_id')]
+        dates = [
+            c for c in chunk.columns
+            if pd.api.types.is_datetime64_any_dtype(chunk[c])
+            or (not pd.api.types.is_numeric_dtype(chunk[c])
+                and any(k in str(c).lower() for k in ('date', 'day', 'week')))
+        ]
+        self.date = dates[0] if dates else None
+        self.metrics = [
+            c for c in chunk.select_dtypes(include=[np.number]).columns if c not in id_like
+        ][:self.max_metrics]
+        labels = id_like + [c for c in chunk.columns if c not in self.metrics and c not in dates]
+        self.label = labels[0] if labels else None
+        n = len(self.metrics)
+        self._sum, self._count = np.zeros(n), np.zeros(n)
+        self._min, self._max = np.full(n, np.inf), np.full(n, -np.inf)
+        self._sample = np.empty((0, n))
+
+    def update(self, chunk: pd.DataFrame) -> 'ResultSketch':
+        """Fold one chunk into the sketch"""
+        if not self.columns:
+            self._init_roles(chunk)
+        if chunk.empty:
+            return self
+        self.rows += len(chunk)
+        for col, count in chunk.isna().sum().items():
+            self.nulls[str(col)] = self.nulls.get(str(col), 0) + int(count)
+
+        if self.metrics:
+            values = chunk[self.metrics].apply(pd.to_numeric, errors='coerce').to_numpy(dtype=float)
+            self._sum += np.nansum(values, axis=0)
+            self._count += np.sum(~np.isnan(values), axis=0)
+            with np.errstate(all='ignore'):
+                self._min = np.fmin(self._min, np.nanmin(values, axis=0, initial=np.inf))
+                self._max = np.fmax(self._max, np.nanmax(values, axis=0, initial=-np.inf))
+
+            # Bottom-k random keys: a uniform sample of all rows seen, mergeable across chunks
+            keys = np.concatenate([self._sample_keys, self._rng.random(len(values))])
+            sample = np.vstack([self._sample, values])
+            if len(keys) > self.sample_size:
+                keep = np.argpartition(keys, self.sample_size)[:self.sample_size]
+                keys, sample = keys[keep], sample[keep]
+            self._sample_keys, self._sample = keys, sample
+
+            if self.label is not None:
+                for metric in self.metrics:
+                    top = chunk.nlargest(self.top_k, metric)[[self.label, metric]]
+                    previous = self._top.get(metric)
+                    merged = top if previous is None else pd.concat([previous, top])
+                    self._top[metric] = merged.nlargest(self.top_k, metric)
+
+            if self.date is not None:
+                days = pd.to_datetime(chunk[self.date], errors='coerce').dt.floor('D')
+                totals = chunk[self.metrics].groupby(days).sum(numeric_only=True)
+                self._periods = totals if self._periods is None else self._periods.add(totals, fill_value=0)
+        return self
+
+    def _period_totals(self, max_periods: int = 60) -> Optional[pd.DataFrame]:
+        """Totals per day, coarsened to weeks or months when there are too many days"""
+        if self._periods is None or self._periods.empty:
+            return None
+        periods = self._periods.sort_index()
+        for freq in ('W-MON', 'MS'):
+            if len(periods) <= max_periods:
+                break
+            periods = periods.resample(freq, label='left', closed='left').sum()
+        return periods
+
+    @staticmethod
+    def _fmt(value: Any) -> str:
+        """Short number formatting for prompts"""
+        if isinstance(value, (int, np.integer)) and not isinstance(value, bool):
+            return f"{value:,}"
+        if isinstance(value, (float, np.floating)):
+            if not np.isfinite(value):
+                return "n/a"
+            return f"{value:,.4g}" if abs(value) < 1000 else f"{value:,.0f}"
+        return str(value)
+
+    def sections(self) -> List[List[str]]:
+        """Summary lines grouped by priority, most important first"""
+        overview = [f"Rows: {self.rows:,}; columns: {', '.join(self.columns)}"]
+        null_cols = {c: n for c, n in self.nulls.items() if n}
+        if null_cols:
+            overview.append("Nulls: " + ", ".join(f"{c}={n:,}" for c, n in null_cols.items()))
+
+        metrics = []
+        quantiles = None
+        if len(self._sample) > 1:
+            with np.errstate(all='ignore'):
+                quantiles = np.nanquantile(self._sample, QUANTILES, axis=0)
+        for i, metric in enumerate(self.metrics):
+            if not self._count[i]:
+                continue
+            if self._count[i] == 1:
+                metrics.append(f"{metric}={self._fmt(self._sum[i])}")
+                continue
+            line = (f"{metric}: sum={self._fmt(self._sum[i])} mean={self._fmt(self._sum[i] / self._count[i])} "
+                    f"min={self._fmt(self._min[i])} max={self._fmt(self._max[i])}")
+            if quantiles is not None:
+                line += " p5/p25/p50/p75/p95=" + "/".join(self._fmt(q) for q in quantiles[:, i])
+            metrics.append(line)
+
+        top = [
+            f"Top {self.label} by {metric}: "
+            + ", ".join(f"{row[0]} ({self._fmt(row[1])})" for row in frame.itertuples(index=False))
+            for metric, frame in self._top.items()
+        ]
+
+        trend = []
+        periods = self._period_totals()
+        if periods is not None and len(periods) > 1:
+            for metric in self.metrics[:3]:
+                series = periods[metric]
+                first, last, previous = series.iloc[0], series.iloc[-1], series.iloc[-2]
+                change = f"{(last - previous) / previous:+.1%}" if previous else "n/a"
+                recent = ", ".join(
+                    f"{idx.date()}={self._fmt(v)}" for idx, v in series.iloc[-6:].items()
+                )
+                trend.append(
+                    f"{metric} per period ({len(series)} periods, {series.index[0].date()} to "
+                    f"{series.index[-1].date()}): first={self._fmt(first)} last={self._fmt(last)} "
+                    f"last vs previous={change}; recent: {recent}"
+                )
+        return [overview, metrics, top, trend]
+
+    def render(self, max_tokens: int = 400) -> str:
+        """Sketch as text, adding lines in priority order until the token budget is reached"""
+        budget = max_tokens * CHARS_PER_TOKEN
+        sections = self.sections()
+        chosen: List[List[str]] = [[] for _ in sections]
+        used = 0
+        # Round-robin over sections so every kind of fact gets in before any one dominates
+        pending = [list(section) for section in sections]
+        while any(pending):
+            for i, section in enumerate(pending):
+                if not section:
+                    continue
+                line = section.pop(0)
+                if used + len(line) + 1 > budget:
+                    section.clear()
+                    continue
+                chosen[i].append(line)
+                used += len(line) + 1
+        return "\n".join(line for section in chosen for line in section)
@@ -0,0 +1,133 @@
+import json
+import sqlite3
+import pandas as pd
+from typing import Dict, List, Tuple
+
+FACT_MEASURES = {
+    'ad_sales_metrics': ['ad_sales', 'ad_spend', 'clicks', 'impressions', 'units_sold'],
+    'total_sales_metrics': ['total_sales', 'total_units_ordered'],
+}
+
+# Rollup table -> grouping keys as (SQL expression over the fact table, output column)
+ROLLUPS = {
+    'rollup_item_metrics': [('item_id', 'item_id')],
+    'rollup_daily_metrics': [('date(date)', 'day')],
+    'rollup_item_weekly_metrics': [('item_id', 'item_id'), ("date(date, '-6 days', 'weekday 1')", 'week_start')],
+}
+GLOBAL_ROLLUP = 'rollup_global_metrics'
+ROLLUP_TABLES = list(ROLLUPS) + [GLOBAL_ROLLUP]
+
+# Ratios are computed from summed components so they stay correct at every grain
+DERIVED_METRICS = {
+    'roas': ('ad_sales', 'ad_spend', "ad_sales / NULLIF(ad_spend, 0)"),
+    'cpc': ('ad_spend', 'clicks', "ad_spend / NULLIF(clicks, 0)"),
+    'ctr': ('clicks', 'impressions', "clicks * 1.0 / NULLIF(impressions, 0)"),
+}
+
+class RollupService:
+    def __init__(self, pool):
+        """Initialize rollup maintenance over a connection pool"""
+        self.pool = pool
+
+    def _measures(self, conn: sqlite3.Connection) -> Dict[str, List[str]]:
+        """Measure columns available in each fact table that exists"""
+        available = {}
+        for table, measures in FACT_MEASURES.items():
+            columns = {row[1] for row in conn.execute(f'PRAGMA table_info("{table}")').fetchall()}
+            if {'date', 'item_id'} <= columns:
+                present = [m for m in measures if m in columns]
+                if present:
+                    available[table] = present
+        return available
+
+    def _derived_sql(self, measure_names: List[str]) -> str:
+        """Derived KPI columns computable from the available measures"""
+        parts = [
+            f"{expr} AS {name}" for name, (num, den, expr) in DERIVED_METRICS.items()
+            if num in measure_names and den in measure_names
+        ]
+        return (", " + ", ".join(parts)) if parts else ""
+
+    def _rollup_select(self, measures: Dict[str, List[str]], keys: List[Tuple[str, str]],
+                       where: str = "") -> str:
+        """SELECT producing one rollup's rows, optionally restricted to some groups"""
+        aliases = [alias for _, alias in keys]
+        key_select = ", ".join(f"{expr} AS {alias}" for expr, alias in keys)
+        parts = []
+        for table, cols in measures.items():
+            sums = ", ".join(f"SUM({c}) AS {c}" for c in cols)
+            parts.append((table, f"SELECT {key_select}, {sums} FROM {table} {where} GROUP BY {', '.join(aliases)}"))
+
+        ctes = ", ".join(f"f{i} AS ({sql})" for i, (_, sql) in enumerate(parts))
+        key_union = " UNION ".join(f"SELECT {', '.join(aliases)} FROM f{i}" for i in range(len(parts)))
+        joins = " ".join(f"LEFT JOIN f{i} USING ({', '.join(aliases)})" for i in range(len(parts)))
+        measure_names = [c for cols in measures.values() for c in cols]
+        inner = f"SELECT k.{', k.'.join(aliases)}, {', '.join(measure_names)} FROM ({key_union}) k {joins}"
+        return f"WITH {ctes} SELECT *{self._derived_sql(measure_names)} FROM ({inner})"
+
+    def _global_select(self, measures: Dict[str, List[str]]) -> str:
+        """Single-row global rollup, summed from the small daily rollup"""
+        measure_names = [c for cols in measures.values() for c in cols]
+        sums = ", ".join(f"SUM({c}) AS {c}" for c in measure_names)
+        return (
+            f"SELECT *{self._derived_sql(measure_names)} FROM "
+            f"(SELECT MIN(day) AS first_day, MAX(day) AS last_day, {sums} FROM rollup_daily_metrics)"
+        )
+
+    def rebuild(self) -> List[str]:
+        """Recompute every rollup from the fact tables, returning the tables written"""
+        with self.pool.writer() as conn:
+            measures = self._measures(conn)
+            if not measures:
+                return []
+            for table, keys in ROLLUPS.items():
+                conn.execute(f"DROP TABLE IF EXISTS {table}")
+                conn.execute(f"CREATE TABLE {table} AS {self._rollup_select(measures, keys)}")
+                conn.execute(
+                    f"CREATE UNIQUE INDEX ux_{table} ON {table} ({', '.join(alias for _, alias in keys)})"
+                )
+            conn.execute(f"DROP TABLE IF EXISTS {GLOBAL_ROLLUP}")
+            conn.execute(f"CREATE TABLE {GLOBAL_ROLLUP} AS {self._global_select(measures)}")
+        print(f"Rollups rebuilt: {', '.join(ROLLUP_TABLES)}")
+        return ROLLUP_TABLES
+
+    def update(self, changed: pd.DataFrame) -> List[str]:
+        """Recompute only the rollup groups touched by new or changed fact rows"""
+        if changed.empty or not {'date', 'item_id'} <= set(changed.columns):
+            return []
+        dates = pd.to_datetime(changed['date'], errors='coerce').dropna()
+        items = json.dumps(pd.unique(changed['item_id']).tolist())
+        days = json.dumps(sorted(dates.dt.strftime('%Y-%m-%d').unique().tolist()))
+        weeks = json.dumps(sorted(
+            (dates - pd.to_timedelta(dates.dt.weekday, unit='D')).dt.strftime('%Y-%m-%d').unique().tolist()
+        ))
+
+        scopes = {
+            'rollup_item_metrics': ("item_id IN (SELECT value FROM json_each(?))", [items]),
+            'rollup_daily_metrics': ("day IN (SELECT value FROM json_each(?))", [days]),
+            'rollup_item_weekly_metrics': (
+                "item_id IN (SELECT value FROM json_each(?)) AND week_start IN (SELECT value FROM json_each(?))",
+                [items, weeks]
+            ),
+        }
+        with self.pool.writer() as conn:
+            existing = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+            if not set(ROLLUP_TABLES) <= existing:
+                conn.commit()
+                return self.rebuild()
+            measures = self._measures(conn)
+            for table, keys in ROLLUPS.items():
+                condition, params = scopes[table]
+                # Fact-side filter: same condition expressed over the grouping expressions
+                fact_condition = condition
+                for expr, alias in keys:
+                    fact_condition = fact_condition.replace(f"{alias} IN", f"{expr} IN")
+                fact_params = params * len(measures)
+                conn.execute(f"DELETE FROM {table} WHERE {condition}", params)
+                conn.execute(
+                    f"INSERT INTO {table} {self._rollup_select(measures, keys, where=f'WHERE {fact_condition}')}",
+                    fact_params
+                )
+            conn.execute(f"DELETE FROM {GLOBAL_ROLLUP}")
+            conn.execute(f"INSERT INTO {GLOBAL_ROLLUP} {self._global_select(measures)}")
+        return ROLLUP_TABLES
@@ -0,0 +1,129 @@
+import threading
+from typing import Dict, Any, Optional, Tuple
+
+# Rough prompt size estimate; Gemini averages about four characters per token on SQL-ish text
+CHARS_PER_TOKEN = 4
+
+# Short notes the model needs beyond the column list
+SCHEMA_NOTES = """Notes:
+- item_id is the product identifier across all tables
+- RoAS = ad_sales / ad_spend, CPC = ad_spend / clicks, CTR = clicks / impressions"""
+
+class SchemaCatalog:
+    def __init__(self, db_service, sample_values: int = 5, max_sample_distinct: int = 50):
+        """Initialize a schema catalog that is rebuilt only when the data version changes"""
+        self.db_service = db_service
+        self.sample_values = sample_values
+        self.max_sample_distinct = max_sample_distinct
+        self._lock = threading.Lock()
+        self._version: Optional[Tuple] = None
+        self._tables: Dict[str, Dict[str, Any]] = {}
+        self._prompts: Dict[Optional[int], str] = {}
+        self.builds = 0
+
+    def data_version(self) -> Tuple:
+        """Schema fingerprint plus the load version of every table (including other processes' loads)"""
+        names = self.db_service._table_names()
+        # Picks up loads made by other processes on the same database file
+        self.db_service._sync_table_versions()
+        cache = self.db_service.result_cache
+        return (self.db_service.get_schema_fingerprint(), tuple((n, cache.table_version(n)) for n in names))
+
+    def _describe_table(self, conn, table_name: str) -> Dict[str, Any]:
+        """Column types, row count, date ranges and low-cardinality value samples for one table"""
+        columns = [
+            {'name': col[1], 'type': col[2], 'not_null': bool(col[3]), 'primary_key': bool(col[5])}
+            for col in conn.execute(f'PRAGMA table_info("{table_name}")').fetchall()
+        ]
+        date_columns = [
+            c['name'] for c in columns
+            if c['type'].upper() in ('TIMESTAMP', 'DATE', 'DATETIME') or 'date' in c['name'].lower()
+            or c['name'].endswith('day') or c['name'] == 'week_start'
+        ]
+        aggregates = ["COUNT(*)"] + [f'MIN("{c}"), MAX("{c}")' for c in date_columns]
+        row = conn.execute(f'SELECT {", ".join(aggregates)} FROM "{table_name}"').fetchone()
+        for i, name in enumerate(date_columns):
+            col = next(c for c in columns if c['name'] == name)
+            col['min'], col['max'] = row[1 + 2 * i], row[2 + 2 * i]
+
+        for col in columns:
+            if col['type'].upper() != 'TEXT' or col['name'] in date_columns:
+                continue
+            # One more than the cap tells us whether the column is low-cardinality enough to sample
+            values = conn.execute(
+                f'SELECT DISTINCT "{col["name"]}" FROM "{table_name}" LIMIT ?', (self.max_sample_distinct + 1,)
+            ).fetchall()
+            if len(values) <= self.max_sample_distinct:
+                col['samples'] = [v for (v,) in values[:self.sample_values] if v is not None]
+        return {'columns': columns, 'row_count': row[0]}
+
+    def _ensure_current(self) -> Dict[str, Dict[str, Any]]:
+        """Rebuild the catalog if any table changed since the last build"""
+        version = self.data_version()
+        with self._lock:
+            if version == self._version:
+                return self._tables
+            tables = {}
+            with self.db_service.pool.reader() as conn:
+                for table_name, _ in version[1]:
+                    tables[table_name] = self._describe_table(conn, table_name)
+            self._tables, self._version, self._prompts = tables, version, {}
+            self.builds += 1
+            return tables
+
+    def tables(self) -> Dict[str, Dict[str, Any]]:
+        """Cached per-table metadata: columns (with samples and ranges) and row counts"""
+        return self._ensure_current()
+
+    @staticmethod
+    def _format_column(col: Dict[str, Any], detail: int) -> str:
+        """One column at the requested level of detail (0 = name only)"""
+        if detail == 0:
+            return col['name']
+        text = f"{col['name']} {col['type']}".rstrip()
+        if 'min' in col and col['min'] is not None:
+            low, high = str(col['min'])[:10], str(col['max'])[:10]
+            text += f" [{low}]" if low == high else f" [{low}..{high}]"
+        if detail >= 2 and col.get('samples'):
+            # Long free-text values (e.g. eligibility messages) only need a recognizable prefix
+            text += " e.g. " + "|".join(repr(str(v)[:40]) for v in col['samples'])
+        return text
+
+    def _render(self, tables: Dict[str, Dict[str, Any]], detail: int) -> str:
+        """Schema text for all tables, raw tables before rollups"""
+        ordered = sorted(tables.items(), key=lambda item: (item[0].startswith('rollup_'), item[0]))
+        lines = [
+            f"{name} ({info['row_count']} rows): "
+            + ", ".join(self._format_column(col, detail) for col in info['columns'])
+            for name, info in ordered
+        ]
+        return "\n".join(lines) + "\n" + SCHEMA_NOTES
+
+    def prompt_context(self, max_tokens: Optional[int] = 600) -> str:
+        """Compact schema description for the SQL prompt, trimmed to fit max_tokens"""
+        tables = self._ensure_current()
+        with self._lock:
+            if max_tokens in self._prompts:
+                return self._prompts[max_tokens]
+
+        # Drop value samples, then types and ranges, then whole rollup tables until it fits
+        text = ""
+        for detail in (2, 1, 0):
+            text = self._render(tables, detail)
+            if max_tokens is None or len(text) <= max_tokens * CHARS_PER_TOKEN:
+                break
+        else:
+            remaining = dict(tables)
+            for name in sorted((n for n in tables if n.startswith('rollup_')), reverse=True):
+                del remaining[name]
+                text = self._render(remaining, 0)
+                if len(text) <= max_tokens * CHARS_PER_TOKEN:
+                    break
+
+        with self._lock:
+            self._prompts[max_tokens] = text
+        return text
+
+    def stats(self) -> Dict[str, Any]:
+        """Number of builds and the current data version"""
+        return {'builds': self.builds, 'tables': len(self._tables), 'version': self._version}
@@ -0,0 +1,170 @@
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, Any, Optional, Set
+
+# Words that flip or narrow a question's meaning while changing few characters. Each maps
+# to a canonical token; near-duplicates must agree on all of them (and on every number).
+# Metric and grain words are included because long questions differing only in
+# "cpc"/"ctr" or "ad"/"total" still share most of their trigrams.
+KEY_WORDS = {
+    **{w: w for w in ('roas', 'cpc', 'ctr', 'ad', 'total', 'sales', 'spend', 'units', 'orders',
+                      'average', 'eligible', 'eligibility')},
+    **{w: w.rstrip('s') for w in ('click', 'clicks', 'impression', 'impressions', 'conversion', 'conversions')},
+    'revenue': 'sales', 'ordered': 'orders', 'avg': 'average', 'mean': 'average',
+    **{w: 'day' for w in ('day', 'days', 'daily')},
+    **{w: 'week' for w in ('week', 'weeks', 'weekly')},
+    **{w: 'month' for w in ('month', 'months', 'monthly')},
+    **{w: 'year' for w in ('year', 'years', 'yearly', 'annual')},
+    **{w: 'item' for w in ('item', 'items', 'product', 'products')},
+    # "don't" normalizes to "don t"
+    **{w: 'not' for w in ('not', 'no', 'non', 'never', 'without', 'ineligible', 't')},
+    **{w: 'desc' for w in ('top', 'highest', 'most', 'best', 'max', 'maximum', 'largest', 'greatest')},
+    **{w: 'asc' for w in ('bottom', 'lowest', 'least', 'worst', 'min', 'minimum', 'smallest')},
+    **{w: w for w in ('before', 'after', 'above', 'below', 'more', 'less', 'increase', 'decrease')},
+    **{m: m[:3] for m in ('january', 'february', 'march', 'april', 'may', 'june', 'july', 'august',
+                          'september', 'october', 'november', 'december')},
+    **{m: m for m in ('jan', 'feb', 'mar', 'apr', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec')},
+    'sept': 'sep',
+}
+
+class SQLCache:
+    def __init__(self, cache_path: str = "sql_cache.db", ttl_seconds: float = 7 * 24 * 3600,
+                 max_entries: int = 1000, similarity_threshold: float = 0.85):
+        """Initialize persistent natural language to SQL cache"""
+        self.cache_path = cache_path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.similarity_threshold = similarity_threshold
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(cache_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode = WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS sql_cache (
+                question TEXT NOT NULL,
+                schema_fingerprint TEXT NOT NULL,
+                sql_query TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used_at REAL NOT NULL,
+                PRIMARY KEY (question, schema_fingerprint)
+            )
+        """)
+        self._conn.commit()
+
+    @staticmethod
+    def normalize_question(question: str) -> str:
+        """Lowercase, strip punctuation and collapse whitespace"""
+        text = re.sub(r"[^a-z0-9\s]", " ", question.lower())
+        return " ".join(text.split())
+
+    @staticmethod
+    def _ngrams(text: str, n: int = 3) -> Set[str]:
+        """Character n-grams of a normalized question"""
+        padded = f" {text} "
+        return {padded[i:i + n] for i in range(max(len(padded) - n + 1, 1))}
+
+    @staticmethod
+    def _key_tokens(text: str) -> Set[str]:
+        """Numbers plus metric, grain, negation, ranking, comparison and month words, which must
+        match exactly for a near-duplicate hit ("eligible" vs "not eligible" share most trigrams)"""
+        words = text.split()
+        return set(re.findall(r"\d+", text)) | {KEY_WORDS[w] for w in words if w in KEY_WORDS}
+
+    def similarity(self, a: str, b: str) -> float:
+        """Jaccard similarity of character trigrams"""
+        grams_a, grams_b = self._ngrams(a), self._ngrams(b)
+        if not grams_a or not grams_b:
+            return 0.0
+        return len(grams_a & grams_b) / len(grams_a | grams_b)
+
+    def get(self, question: str, schema_fingerprint: str = "") -> Optional[str]:
+        """Return cached SQL for an exact or near-duplicate question"""
+        normalized = self.normalize_question(question)
+        now = time.time()
+        with self._lock:
+            self._conn.execute("DELETE FROM sql_cache WHERE created_at < ?", (now - self.ttl_seconds,))
+            row = self._conn.execute(
+                "SELECT question, sql_query FROM sql_cache WHERE question = ? AND schema_fingerprint = ?",
+                (normalized, schema_fingerprint)
+            ).fetchone()
+
+            if row is None:
+                best_score, keys = 0.0, self._key_tokens(normalized)
+                candidates = self._conn.execute(
+                    "SELECT question, sql_query FROM sql_cache WHERE schema_fingerprint = ?",
+                    (schema_fingerprint,)
+                ).fetchall()
+                for candidate in candidates:
+                    if self._key_tokens(candidate[0]) != keys:
+                        continue
+                    score = self.similarity(normalized, candidate[0])
+                    if score >= self.similarity_threshold and score > best_score:
+                        best_score, row = score, candidate
+                if row is not None:
+                    self.near_hits += 1
+            else:
+                self.hits += 1
+
+            if row is None:
+                self.misses += 1
+                self._conn.commit()
+                return None
+
+            self._conn.execute(
+                "UPDATE sql_cache SET last_used_at = ? WHERE question = ? AND schema_fingerprint = ?",
+                (now, row[0], schema_fingerprint)
+            )
+            self._conn.commit()
+            return row[1]
+
+    def put(self, question: str, sql_query: str, schema_fingerprint: str = "") -> None:
+        """Store generated SQL, evicting least recently used entries over capacity"""
+        normalized = self.normalize_question(question)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sql_cache VALUES (?, ?, ?, ?, ?)",
+                (normalized, schema_fingerprint, sql_query, now, now)
+            )
+            self._conn.execute("""
+                DELETE FROM sql_cache WHERE rowid IN (
+                    SELECT rowid FROM sql_cache ORDER BY last_used_at DESC LIMIT -1 OFFSET ?
+                )
+            """, (self.max_entries,))
+            self._conn.commit()
+
+    def invalidate_table(self, table_name: str) -> None:
+        """Drop cached SQL that references a replaced table"""
+        pattern = re.compile(rf"\b{re.escape(table_name)}\b", re.IGNORECASE)
+        with self._lock:
+            rows = self._conn.execute("SELECT rowid, sql_query FROM sql_cache").fetchall()
+            stale = [(rowid,) for rowid, sql_query in rows if pattern.search(sql_query)]
+            self._conn.executemany("DELETE FROM sql_cache WHERE rowid = ?", stale)
+            self._conn.commit()
+
+    def clear(self) -> None:
+        """Remove every cached entry"""
+        with self._lock:
+            self._conn.execute("DELETE FROM sql_cache")
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters and current size"""
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM sql_cache").fetchone()[0]
+        return {
+            'hits': self.hits,
+            'near_hits': self.near_hits,
+            'misses': self.misses,
+            'entries': size
+        }
+
+    def close(self) -> None:
+        """Close the cache database"""
+        with self._lock:
+            self._conn.close()
@@ -1,22 +1,166 @@
+import hashlib
+import threading
+from collections import OrderedDict
 import plotly.graph_objects as go
 import plotly.express as px
+import plotly.offline
 import pandas as pd
-from typing import Optional
+from typing import Optional, Tuple
 import numpy as np
 
+# Column-name fragments of measures that are ratios or averages; summing them is meaningless
+RATIO_HINTS = ('roas', 'cpc', 'ctr', 'rate', 'ratio', 'avg', 'average', 'mean', 'pct', 'percent', 'margin', 'per_')
+DATE_HINTS = ('date', 'day', 'week', 'month')
+
 class VisualizationService:
-    def __init__(self):
-        """Initialize visualization service"""
-        pass
+    def __init__(self, max_points: int = 2000, max_categories: int = 20, max_bins: int = 100,
+                 max_cached_figures: int = 32):
+        """Initialize visualization service
+
+        max_points caps the points per line or scatter trace and max_categories the
+        bars or slices (the rest are folded into "Other", or into coarser periods for a
+        date axis), so a figure's size does not grow with the result size. Built figures
+        are memoized by result content, chart type and columns.
+        """
+        self.max_points = max_points
+        self.max_categories = max_categories
+        self.max_bins = max_bins
+        self.max_cached_figures = max_cached_figures
+        self.hits = 0
+        self.misses = 0
+        self._figures: 'OrderedDict[Tuple, go.Figure]' = OrderedDict()
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def result_hash(data: pd.DataFrame) -> str:
+        """Content hash of a result (values, columns and dtypes)"""
+        digest = hashlib.sha1(repr([(str(c), str(t)) for c, t in data.dtypes.items()]).encode())
+        digest.update(pd.util.hash_pandas_object(data, index=False).to_numpy().tobytes())
+        return digest.hexdigest()
+    
+    @staticmethod
+    def _split_columns(data: pd.DataFrame):
+        """Numeric measure columns and label columns; id-like numeric columns count as labels"""
+        id_like = [c for c in data.columns if str(c).lower() == 'id' or str(c).lower().endswith('_id')]
+        numeric_cols = [c for c in data.select_dtypes(include=[np.number]).columns if c not in id_like]
+        non_numeric_cols = [c for c in data.columns if c not in numeric_cols]
+        return numeric_cols, non_numeric_cols
+    
+    @staticmethod
+    def _is_ratio(column) -> bool:
+        """Whether a measure is a ratio or average, so groups are averaged rather than summed"""
+        return any(hint in str(column).lower() for hint in RATIO_HINTS)
+    
+    @staticmethod
+    def _is_date_like(data: pd.DataFrame, column) -> bool:
+        """Whether a column is a date axis (datetime dtype or a date-ish name)"""
+        return pd.api.types.is_datetime64_any_dtype(data[column]) or \
+            any(hint in str(column).lower() for hint in DATE_HINTS)
+    
+    @staticmethod
+    def _as_float(values: pd.Series) -> np.ndarray:
+        """Numeric view of an x axis (datetimes as nanoseconds) for downsampling"""
+        if pd.api.types.is_datetime64_any_dtype(values):
+            return values.astype('int64').to_numpy(dtype=float)
+        return pd.to_numeric(values, errors='coerce').to_numpy(dtype=float)
+    
+    @staticmethod
+    def lttb_indices(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+        """Largest-Triangle-Three-Buckets: indices of n_out points that keep the visual shape of a series"""
+        n = len(x)
+        if n_out >= n or n_out < 3:
+            return np.arange(n)
+        edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+        selected = np.empty(n_out, dtype=int)
+        selected[0], selected[-1] = 0, n - 1
+        previous = 0
+        for i in range(n_out - 2):
+            start, end = edges[i], edges[i + 1]
+            next_end = edges[i + 2] if i + 2 < len(edges) else n
+            next_start = end if end < next_end else n - 1
+            avg_x = x[next_start:next_end].mean() if next_end > next_start else x[-1]
+            avg_y = y[next_start:next_end].mean() if next_end > next_start else y[-1]
+            # Pick the point forming the largest triangle with the previous pick and the next bucket's mean
+            area = np.abs(
+                (x[previous] - avg_x) * (y[start:end] - y[previous])
+                - (x[previous] - x[start:end]) * (avg_y - y[previous])
+            )
+            previous = start + int(np.argmax(area))
+            selected[i + 1] = previous
+        return selected
+    
+    @staticmethod
+    def minmax_indices(y: np.ndarray, n_out: int) -> np.ndarray:
+        """Indices of the minimum and maximum of each bucket, keeping spikes that LTTB can smooth over"""
+        n = len(y)
+        if n_out >= n or n_out < 2:
+            return np.arange(n)
+        buckets = np.array_split(np.arange(n), n_out // 2)
+        picks = [idx for b in buckets if len(b) for idx in (b[np.argmin(y[b])], b[np.argmax(y[b])])]
+        return np.unique(picks)
+    
+    def downsample_series(self, data: pd.DataFrame, x_col: str, y_col: str, method: str = 'lttb') -> pd.DataFrame:
+        """Reduce a sorted series to at most max_points rows"""
+        if len(data) <= self.max_points:
+            return data
+        x = self._as_float(data[x_col])
+        y = pd.to_numeric(data[y_col], errors='coerce').to_numpy(dtype=float)
+        valid = ~(np.isnan(x) | np.isnan(y))
+        data, x, y = data[valid], x[valid], y[valid]
+        if method == 'minmax':
+            indices = self.minmax_indices(y, self.max_points)
+        else:
+            indices = self.lttb_indices(x, y, self.max_points)
+        return data.iloc[indices]
+    
+    def top_n_with_other(self, data: pd.DataFrame, label_col: str, value_col: str,
+                         n: Optional[int] = None) -> pd.DataFrame:
+        """Aggregate values per label, keep the n-1 largest and fold the rest into an "Other" row
+
+        Ratio measures (RoAS, CPC, CTR, averages) are averaged instead of summed, and
+        their bucket is labelled "Other (avg)".
+        """
+        n = n or self.max_categories
+        agg = 'mean' if self._is_ratio(value_col) else 'sum'
+        grouped = data.groupby(data[label_col].astype(str), sort=False)[value_col].agg(agg)
+        if len(grouped) <= n:
+            return grouped.reset_index()
+        top = grouped.nlargest(n - 1)
+        rest = grouped.drop(top.index)
+        other = pd.Series({'Other (avg)': rest.mean()} if agg == 'mean' else {'Other': rest.sum()})
+        return pd.concat([top, other]).rename_axis(label_col).rename(value_col).reset_index()
     
-    def create_visualization(self, question: str, data: pd.DataFrame) -> Optional[go.Figure]:
+    def time_buckets(self, data: pd.DataFrame, x_col: str, y_col: str) -> pd.DataFrame:
+        """Aggregate a measure over a date axis into at most max_categories periods, in time order"""
+        agg = 'mean' if self._is_ratio(y_col) else 'sum'
+        dates = pd.to_datetime(data[x_col], errors='coerce')
+        series = data[y_col].groupby(dates).agg(agg)
+        for freq in ('D', 'W-MON', 'MS', 'QS', 'YS'):
+            buckets = series.resample(freq, label='left', closed='left').agg(agg)
+            if len(buckets) <= self.max_categories:
+                break
+        return buckets.rename_axis(x_col).rename(y_col).reset_index()
+    
+    def create_visualization(self, question: str, data: pd.DataFrame, viz_type: Optional[str] = None) -> Optional[go.Figure]:
         """Create appropriate visualization based on question and data"""
         try:
             if data.empty:
                 return None
             
             # Determine visualization type based on question keywords and data structure
-            viz_type = self._determine_viz_type(question, data)
+            if not viz_type:
+                viz_type = self._determine_viz_type(question, data)
+            
+            key = (self.result_hash(data), viz_type, tuple(map(str, data.columns)),
+                   self.max_points, self.max_categories, self.max_bins)
+            with self._lock:
+                cached = self._figures.get(key)
+                if cached is not None:
+                    self._figures.move_to_end(key)
+                    self.hits += 1
+                    # Callers may restyle the figure, so hand out a copy
+                    return go.Figure(cached)
+                self.misses += 1
             
             if viz_type == 'pie':
                 chart = self._create_pie_chart(data)
@@ -29,6 +173,12 @@ class VisualizationService:
             else:
                 chart = self._create_bar_chart(data)
             
+            if chart is not None:
+                with self._lock:
+                    self._figures[key] = chart
+                    while len(self._figures) > self.max_cached_figures:
+                        self._figures.popitem(last=False)
+                chart = go.Figure(chart)
             return chart
                 
         except Exception as e:
@@ -55,8 +205,7 @@ class VisualizationService:
         """Create a bar chart"""
         try:
             # Find the most appropriate columns for x and y
-            numeric_cols = data.select_dtypes(include=[np.number]).columns.tolist()
-            non_numeric_cols = data.select_dtypes(exclude=[np.number]).columns.tolist()
+            numeric_cols, non_numeric_cols = self._split_columns(data)
             
             if len(numeric_cols) >= 1:
                 y_col = numeric_cols[0]
@@ -68,8 +217,17 @@ class VisualizationService:
                 else:
                     x_col = data.columns[0]
                 
-                # Limit data points for better visualization
-                plot_data = data.head(20)
+                # A date axis keeps its order (in coarser periods if needed); other labels keep
+                # the largest categories and fold the rest into "Other", instead of dropping rows
+                if self._is_date_like(data, x_col) and x_col in non_numeric_cols:
+                    if len(data) > self.max_categories:
+                        plot_data = self.time_buckets(data, x_col, y_col)
+                    else:
+                        plot_data = data.sort_values(by=x_col)
+                elif len(data) > self.max_categories:
+                    plot_data = self.top_n_with_other(data, x_col, y_col)
+                else:
+                    plot_data = data.astype({x_col: str}) if x_col in non_numeric_cols else data
                 
                 fig = px.bar(
                     plot_data, 
@@ -97,18 +255,14 @@ class VisualizationService:
         """Create a pie chart"""
         try:
             # Find categorical and numeric columns
-            numeric_cols = data.select_dtypes(include=[np.number]).columns.tolist()
-            non_numeric_cols = data.select_dtypes(exclude=[np.number]).columns.tolist()
+            numeric_cols, non_numeric_cols = self._split_columns(data)
             
             if len(numeric_cols) >= 1 and len(non_numeric_cols) >= 1:
                 labels_col = non_numeric_cols[0]
                 values_col = numeric_cols[0]
                 
-                # Group by category and sum values
-                grouped_data = data.groupby(labels_col)[values_col].sum().reset_index()
-                
-                # Limit to top 10 categories
-                grouped_data = grouped_data.nlargest(10, values_col)
+                # Group by category and sum values; small categories are combined into "Other"
+                grouped_data = self.top_n_with_other(data, labels_col, values_col, n=min(self.max_categories, 10))
                 
                 fig = px.pie(
                     grouped_data,
@@ -133,27 +287,37 @@ class VisualizationService:
         """Create a line chart"""
         try:
             numeric_cols = data.select_dtypes(include=[np.number]).columns.tolist()
+            date_cols = [c for c in data.columns if self._is_date_like(data, c)]
             
-            if len(numeric_cols) >= 2:
+            measures = [c for c in numeric_cols if c not in date_cols]
+            if date_cols and measures:
+                x_col, y_col = date_cols[0], measures[0]
+                data = data.assign(**{x_col: pd.to_datetime(data[x_col], errors='coerce')})
+                # Several rows per date (e.g. one per item) become one value per date:
+                # a total for additive measures, an average for ratios like CPC
+                if data[x_col].duplicated().any():
+                    agg = 'mean' if self._is_ratio(y_col) else 'sum'
+                    data = data.groupby(x_col, as_index=False)[y_col].agg(agg)
+            elif len(numeric_cols) >= 2:
                 x_col = numeric_cols[0]
                 y_col = numeric_cols[1]
-                
-                # Sort by x column for proper line connection
-                plot_data = data.sort_values(by=x_col).head(50)
-                
-                fig = px.line(
-                    plot_data,
-                    x=x_col,
-                    y=y_col,
-                    title=f"{y_col} Trend",
-                    template="plotly_white"
-                )
-                
-                fig.update_layout(height=500)
-                
-                return fig
-                
-            return None
+            else:
+                return None
+            
+            # Sort by x column for proper line connection, then keep the shape within the point budget
+            plot_data = self.downsample_series(data.sort_values(by=x_col), x_col, y_col)
+            
+            fig = px.line(
+                plot_data,
+                x=x_col,
+                y=y_col,
+                title=f"{y_col} Trend",
+                template="plotly_white"
+            )
+            
+            fig.update_layout(height=500)
+            
+            return fig
             
         except Exception as e:
             print(f"Error creating line chart: {str(e)}")
@@ -168,14 +332,16 @@ class VisualizationService:
                 x_col = numeric_cols[0]
                 y_col = numeric_cols[1]
                 
-                plot_data = data.head(100)  # Limit points for performance
+                # Uniform sample within the point budget; WebGL keeps large point clouds responsive
+                plot_data = data.sample(n=self.max_points, random_state=0) if len(data) > self.max_points else data
                 
                 fig = px.scatter(
                     plot_data,
                     x=x_col,
                     y=y_col,
                     title=f"{y_col} vs {x_col}",
-                    template="plotly_white"
+                    template="plotly_white",
+                    render_mode='webgl' if len(plot_data) > 1000 else 'auto'
                 )
                 
                 fig.update_layout(height=500)
@@ -196,11 +362,28 @@ class VisualizationService:
             if len(numeric_cols) >= 1:
                 col = numeric_cols[0]
                 
-                fig = px.histogram(
-                    data,
-                    x=col,
+                # Bin with NumPy so the figure carries bin counts rather than every row
+                values = pd.to_numeric(data[col], errors='coerce').to_numpy(dtype=float)
+                values = values[np.isfinite(values)]
+                if len(values) == 0:
+                    return None
+                edges = np.histogram_bin_edges(values, bins='auto')
+                if len(edges) - 1 > self.max_bins:
+                    edges = np.histogram_bin_edges(values, bins=self.max_bins)
+                counts, edges = np.histogram(values, bins=edges)
+                
+                fig = go.Figure(go.Bar(
+                    x=(edges[:-1] + edges[1:]) / 2,
+                    y=counts,
+                    width=np.diff(edges),
+                    name=col
+                ))
+                fig.update_layout(
                     title=f"Distribution of {col}",
-                    template="plotly_white"
+                    template="plotly_white",
+                    xaxis_title=col,
+                    yaxis_title="count",
+                    bargap=0
                 )
                 
                 fig.update_layout(height=500)
@@ -233,3 +416,25 @@ class VisualizationService:
         except Exception as e:
             print(f"Error creating custom chart: {str(e)}")
             return None
+    
+    @staticmethod
+    def export_figure(fig: go.Figure, fmt: str = 'json') -> str:
+        """Serialize a figure for download without embedding plotly.js
+
+        'json' is the compact Plotly figure spec (load with plotly.io.from_json or
+        Plotly.newPlot). 'html' is a page that loads plotly.min.js from the same folder,
+        so the ~3 MB bundle is saved once (see plotly_js) rather than in every chart.
+        """
+        if fmt == 'html':
+            return fig.to_html(include_plotlyjs='directory', full_html=True)
+        return fig.to_json()
+    
+    @staticmethod
+    def plotly_js() -> str:
+        """The plotly.js bundle shipped with the installed plotly package"""
+        return plotly.offline.get_plotlyjs()
+    
+    def cache_stats(self) -> dict:
+        """Figure cache hit/miss counters"""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'figures': len(self._figures)}